@@ -2,10 +2,21 @@
 import unittest
 from shapely.geometry import Polygon
 import numpy as np
+import os
+import json
+import tempfile
 
 import assets
 import plates
 import heightfunc
+import world
+import render
+import topology
+import instrumentation
+import ghosts
+import snapshot
+import boundaries
+import benchmark
 
 
 class TestAssets(unittest.TestCase):
@@ -17,6 +28,38 @@ class TestAssets(unittest.TestCase):
         self.assertEqual(tuple(assets.getborderpointbyvector(np.array([5, 5]), np.array([1, 1]), self.Polygon)[0]), (10, 10))
         self.assertFalse(tuple(assets.getborderpointbyvector(np.array([0, 5]), np.array([1, 0]), self.Polygon)[0]) == (0, 5))
 
+    def test_edge_table(self):
+        edges = assets.EdgeTable(self.Polygon.exterior.coords[:-1])
+        self.assertTrue(edges.touches(np.array([0, 5])))
+        self.assertFalse(edges.touches(np.array([5, 5])))
+        self.assertTrue(edges.contains(np.array([5, 5])))
+        self.assertFalse(edges.contains(np.array([11, 5])))
+        self.assertTrue(np.allclose(edges.centroid, (5, 5)))
+        for p in (np.array([5, 5]), np.array([2, 7]), np.array([0, 5])):
+            for v in plates.create_rays(6):
+                for a, b in zip(assets.getborderpointbyvector(p, v, edges), assets.getborderpointbyvector(p, v, self.Polygon)):
+                    self.assertTrue(np.array_equal(a, b))
+        with self.assertRaises(ValueError):
+            edges.starts[0] = (1, 1)
+
+    def test_getborderpointsbyvectors(self):
+        points = np.array([[5, 5], [2, 7], [0, 5]])
+        rays = np.array(plates.create_rays(6))
+        Q, edges, distances = assets.getborderpointsbyvectors(points, rays, np.array(self.Polygon.exterior.coords[:-1]))
+        for i, p in enumerate(points):
+            for j, v in enumerate(rays):
+                expected, E1, E2 = assets.getborderpointbyvector(p, v, self.Polygon)
+                self.assertTrue(np.allclose(Q[i, j], expected))
+                self.assertTrue(np.allclose(self.Polygon.exterior.coords[int(edges[i, j])], E1))
+
+    def test_grid_in_convex_polygon(self):
+        xs, ys = np.arange(-1, 12), np.arange(-1, 12)
+        vertices = np.array(self.Polygon.exterior.coords[:-1])
+        points = np.stack(np.meshgrid(xs, ys, indexing="ij"), axis=-1).reshape(-1, 2)
+        for strict in (False, True):
+            expected = assets.points_in_convex_polygon(points, vertices, strict=strict).reshape(len(xs), len(ys))
+            self.assertTrue(np.array_equal(assets.grid_in_convex_polygon(xs, ys, vertices, strict=strict), expected))
+
     def test_getPointOnLinesegment(self):
         self.assertEqual(tuple(assets.getPointOnLinesegment(np.array([0, 0]), np.array([1, 0]), np.array([2, 1]), np.array([2, -1]))), (2, 0))
         self.assertEqual(tuple(assets.getPointOnLinesegment(np.array([0, 0]), np.array([1, 0]), np.array([2, 1]), np.array([2, 0]))), (2, 0))
@@ -43,6 +86,39 @@ class TestPlates(unittest.TestCase):
         self.assertEqual(split_plates[0].PType, self.plate.PType)
         self.assertEqual(split_plates[0].PType, split_plates[1].PType)
 
+    def test_plateset(self):
+        a, b = self.plate.split(np.array([0, 0]), t=1)
+        c, d = b.split(np.array([9, 9]), t=.5)
+        plate_set = plates.PlateSet([a, b])
+        self.assertEqual(len(plate_set), 2)
+        self.assertIs(plate_set[1], b)
+        del plate_set[0]
+        plate_set.extend([c, d])
+        self.assertEqual(list(plate_set), [b, c, d])
+        self.assertEqual(plate_set.index(d), 2)
+        # die entfernte Platte behält ihre Daten
+        self.assertEqual(a.vertices, ((0, 0), (10, 0), (10.0, 5.0), (0.0, 5.0)))
+        self.assertEqual(c.vertices, tuple(map(tuple, plate_set.vertices(1).tolist())))
+        for plate, bbox, centroid in zip(plate_set, plate_set.bboxes(), plate_set.centroids()):
+            polygon = Polygon(plate.vertices)
+            self.assertTrue(np.allclose(bbox, polygon.bounds))
+            self.assertTrue(np.allclose(centroid, polygon.centroid.coords[0]))
+        with self.assertRaises(ValueError):
+            plates.PlateSet([c])
+
+    def test_edges_cache(self):
+        edges = self.plate.edges
+        self.assertIs(self.plate.edges, edges)
+        self.assertTrue(np.array_equal(edges.starts, self.plate.vertex_array))
+        self.plate.vertices = [(0, 0), (0, 5), (5, 5), (5, 0)]
+        self.assertIsNot(self.plate.edges, edges)
+        self.assertTrue(np.array_equal(self.plate.edges.starts, self.plate.vertex_array))
+        plate_set = plates.PlateSet([self.plate])
+        edges = self.plate.edges
+        plate_set.update_vertices({0: [(0, 0), (0, 4), (4, 4), (4, 0)]})
+        self.assertIsNot(self.plate.edges, edges)
+        self.assertEqual(self.plate.edges.ends[0].tolist(), [0, 4])
+
 
 class Test_Heightfunc(unittest.TestCase):
     def setUp(self):
@@ -58,3 +134,268 @@ class Test_Heightfunc(unittest.TestCase):
         u1, u2 = heightfunc.get_drift_vector_relations(self.plate1, self.plate2, (np.array([0, 5]), np.array([10, 5])))
         self.assertTrue(heightfunc.is_div(self.plate1, self.plate2, u1, u2))
         self.assertFalse(heightfunc.is_div(self.plate1, self.plate2, u2, u1))
+
+    def test_interaction_table(self):
+        border = (np.array([0., 5.]), np.array([10., 5.]))
+        table = heightfunc.InteractionTable()
+        for x in (0., .5, 3.):
+            self.assertEqual(heightfunc.get_height_func(x, self.plate1, self.plate2, border, table),
+                             heightfunc.get_height_func(x, self.plate1, self.plate2, border))
+        self.assertEqual(len(table), 1)
+        table.invalidate(self.plate2)
+        self.assertEqual(len(table), 0)
+
+    def test_get_height_array(self):
+        x = np.linspace(0, 20, 50)
+        T = np.linspace(.001, .01, 50)
+        codes = np.arange(50) % 6
+        expected = [heightfunc.evaluate_relief(c, t, v*.05) for v, t, c in zip(x, T, codes)]
+        self.assertEqual(list(heightfunc.get_height_array(x, T, codes)), expected)
+
+
+class TestWorld(unittest.TestCase):
+    def setUp(self):
+        self.world = world.World((16, 16), seed=0)
+        for _ in range(5):
+            self.world.split()
+
+    def test_getPlates(self):
+        points = np.array([[0, 0], [3.5, 7.25], [16, 16], [8, 0]])
+        indices = self.world.getPlates(points)
+        for point, index in zip(points, indices):
+            self.assertIs(self.world.plates[index], self.world.getPlate(point))
+
+    def test_index_after_split(self):
+        labels = self.world.index.labels.copy()
+        self.world.index.rebuild()
+        self.assertTrue(np.array_equal(labels, self.world.index.labels))
+
+    def test_generate(self):
+        generated = world.World((16, 16))
+        stats = instrumentation.RenderStats()
+        generated.generate(5, seed=0, stats=stats)
+        self.assertEqual(stats.counters["splits"], 5)
+        self.assertEqual(generated.age, self.world.age)
+        self.assertTrue(np.array_equal(generated.plates.coords, self.world.plates.coords))
+        self.assertTrue(np.array_equal(generated.index.labels, self.world.index.labels))
+        self.assertEqual(generated.random.getstate(), self.world.random.getstate())
+
+    def test_copy_plates(self):
+        coords = self.world.plates.coords.copy()
+        for source in (self.world.plates, list(self.world.plates)):
+            copied = world.World(self.world.size, source, seed=1)
+            self.assertTrue(np.array_equal(copied.plates.coords, coords))
+            self.assertFalse(set(copied.plates) & set(self.world.plates))
+            copied.split()
+        self.assertTrue(np.array_equal(self.world.plates.coords, coords))
+        self.assertTrue(np.array_equal(self.world.render_world(4, engine="vector"),
+                                       world.World(self.world.size, list(self.world.plates)).render_world(4, engine="vector")))
+        # übergebene Strukturen werden auch dann übernommen, wenn sie leer sind
+        lines = boundaries.BoundaryLines((), self.world.size)
+        self.assertIs(world.World(self.world.size, self.world.plates.copy(), boundaries=lines).boundaries, lines)
+
+    def test_step(self):
+        heights = self.world.render_world(4, engine="vector")
+        area = sum(Polygon(plate.vertices).area for plate in self.world.plates)
+        stats = instrumentation.RenderStats()
+        for i in range(4):
+            self.world.step(0.5, stats=stats)
+            if i == 1:
+                self.world.split()
+        self.assertEqual(stats.counters["steps"], 4)
+        self.assertEqual(self.world.time, 2.)
+        self.assertAlmostEqual(sum(Polygon(plate.vertices).area for plate in self.world.plates), area)
+
+        rebuilt = topology.Adjacency(self.world.plates, self.world.size)
+        for plate in self.world.plates:
+            self.assertEqual(set(self.world.adjacency.neighbours(plate)), set(rebuilt.neighbours(plate)))
+        labels = self.world.index.labels.copy()
+        self.world.index.rebuild()
+        self.assertTrue(np.array_equal(labels, self.world.index.labels))
+        updated = self.world.update_render(heights, 4, engine="vector")
+        self.assertTrue(np.array_equal(updated, self.world.render_world(4, engine="vector")))
+
+    def test_simulate_border_pixels(self):
+        # Pixel auf dem Rand der Welt neben einer gedrifteten Ecke wurden früher aus ihrer Platte hinausgeschoben
+        drifting = world.World((32, 24), seed=17)
+        drifting.generate(30)
+        for heights in drifting.simulate(3, dt=1., res=4, engine="vector"):
+            self.assertFalse(np.isnan(heights).any())
+
+    def test_adjacency_after_split(self):
+        rebuilt = topology.Adjacency(self.world.plates, self.world.size)
+        for plate in self.world.plates:
+            self.assertEqual(set(self.world.adjacency.neighbours(plate)), set(rebuilt.neighbours(plate)))
+            for incremental, expected in zip(self.world.adjacency.edges[plate], rebuilt.edges[plate]):
+                self.assertEqual([s[2] for s in incremental], [s[2] for s in expected])
+                self.assertTrue(np.allclose([s[:2] for s in incremental], [s[:2] for s in expected]))
+
+    def test_vector_engine(self):
+        scalar = self.world.render_world(4)
+        vector = self.world.render_world(4, engine="vector")
+        self.assertTrue(np.allclose(scalar, vector))
+
+    def test_render_stats(self):
+        stats = instrumentation.RenderStats()
+        calls = []
+        self.world.render_world(4, engine="vector", tile_size=5, progress=lambda done, total: calls.append((done, total)), stats=stats)
+        self.assertEqual(stats.counters["points"], 16*16)
+        self.assertEqual(stats.counters["rays"], 16*16*4)
+        self.assertEqual(set(stats.timers), {"plate_lookup", "intersection", "neighbour_lookup", "height_function", "weighted_average"})
+        self.assertEqual(calls[-1], (16*16, 16*16))
+
+    def test_parallel_render(self):
+        serial = self.world.render_world(4, engine="vector")
+        parallel = self.world.render_world(4, engine="vector", workers=2, tile_size=5)
+        self.assertTrue(np.array_equal(serial, parallel))
+        with self.assertRaises(ValueError):
+            self.world.render_world(4, engine="vector", workers=0)
+
+    def test_render_to_file_resume(self):
+        expected = self.world.render_world(4, engine="vector")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "heights.npy")
+            stream = render.stream_to_file(self.world, path, 4, "vector", tile_size=6)
+            next(stream)
+            stream.close()
+            self.assertEqual(np.load(path + ".tiles.npy").sum(), 1)
+            heights = self.world.render_to_file(path, 4, "vector", tile_size=6)
+            self.assertTrue(np.array_equal(expected, heights))
+            del heights
+            # nach einer Änderung der Welt wird nicht der alte Render zurückgegeben
+            self.world.split()
+            heights = self.world.render_to_file(path, 4, "vector", tile_size=6)
+            self.assertTrue(np.array_equal(self.world.render_world(4, engine="vector"), heights))
+            del heights
+
+    def test_update_render(self):
+        heights = self.world.render_world(4, engine="vector")
+        self.world.split()
+        self.world.split()
+        self.assertTrue(self.world.dirty_mask().any())
+        updated = self.world.update_render(heights, 4, "vector")
+        self.assertFalse(self.world.dirty_mask().any())
+        self.assertTrue(np.array_equal(updated, self.world.render_world(4, engine="vector")))
+
+    def test_distance_engine_bound(self):
+        points = np.array([[3, 4], [8, 8], [12, 1], [15, 15]], dtype=float)
+        vector = self.world.getPointHeights(points, 8)
+        distance = self.world.getPointHeightsByDistance(points)
+        for point, h_vector, h_distance in zip(points, vector, distance):
+            plate = self.world.getPlate(point)
+            vertices = np.array(plate.vertices, dtype=float)
+            edge_heights = []
+            for i, segments in enumerate(self.world.adjacency.edges[plate]):
+                E1, E2 = vertices[i], vertices[(i+1) % len(vertices)]
+                d = E2 - E1
+                line_distance = abs(d[0]*(point[1]-E1[1]) - d[1]*(point[0]-E1[0])) / np.linalg.norm(d)
+                edge_heights += [heightfunc.get_height_func(line_distance*.1, plate, s[2], (E1, E2)) for s in segments]
+            for h in (h_vector, h_distance):
+                self.assertGreaterEqual(h, min(edge_heights) - 1e-3)
+                self.assertLessEqual(h, max(edge_heights) + 1e-3)
+
+    def test_render_adaptive(self):
+        full = self.world.render_world(4, engine="vector")
+        self.assertTrue(np.allclose(self.world.render_adaptive(4, tolerance=0, base_step=4), full))
+        stats = instrumentation.RenderStats()
+        adaptive = self.world.render_adaptive(4, tolerance=1., base_step=4, stats=stats)
+        self.assertFalse(np.isnan(adaptive).any())
+        self.assertEqual(stats.counters["samples"] + stats.counters["interpolated"], 16*16)
+        self.assertLess(stats.counters["samples"], 16*16)
+
+    def test_ghost_lookup(self):
+        points = np.array([[-0.2, 3.5], [16.3, 7.1], [5.5, -0.4], [8.2, 16.1], [-0.1, -0.1], [16.2, 16.3]])
+        self.assertTrue(np.array_equal(self.world.getPlates(points), self.world.getPlates(points % 16)))
+        layer = ghosts.GhostLayer(self.world.plates, self.world.size)
+        self.assertTrue(np.array_equal(layer.plate_ids, self.world.index.ghosts.plate_ids))
+        self.assertTrue(np.allclose(layer.offsets, self.world.index.ghosts.offsets))
+
+    def test_wrapped_rays(self):
+        # zwei Streifen über die ganze Breite: die Höhen dürfen nicht von x abhängen. Ausgenommen sind Pixel auf dem Rand
+        # der Welt, die zur Mitte ihrer Platte hin verschoben werden (siehe getborderpointbyvector).
+        strips = world.World((16, 16))
+        strips.split(np.array((8., 3.3)))
+        stats = instrumentation.RenderStats()
+        heights = strips.render_world(6, engine="vector", stats=stats)
+        self.assertGreater(stats.counters["wrapped_rays"], 0)
+        self.assertTrue(np.allclose(heights[1:, 1:], heights[1:, 1:2]))
+        self.assertTrue(np.allclose(heights, strips.render_world(6, engine="scalar")))
+        distance = strips.render_world(engine="distance")
+        self.assertTrue(np.allclose(distance, distance[:, :1]))
+
+    def test_adaptive_rays(self):
+        points = np.array([[3, 4], [8, 8], [12, 1], [15, 15], [0.5, 9]], dtype=float)
+        # ohne Toleranz werden alle Winkel halbiert, mit unendlicher Toleranz keiner.
+        heights, counts = self.world.getPointHeightsAdaptive(points, 24, 6, tolerance=-1)
+        self.assertTrue(np.allclose(heights, self.world.getPointHeights(points, 24)))
+        self.assertTrue((counts == 24).all())
+        heights, counts = self.world.getPointHeightsAdaptive(points, 24, 6, tolerance=np.inf)
+        self.assertTrue(np.allclose(heights, self.world.getPointHeights(points, 6)))
+        self.assertTrue((counts == 6).all())
+
+        stats = instrumentation.RenderStats()
+        heights, counts = self.world.render_ray_counts(4, stats=stats)
+        self.assertEqual(counts.shape, (16, 16))
+        self.assertEqual(stats.counters["rays"], counts.sum())
+        self.assertTrue(((counts >= 4) & (counts <= 64)).all())
+        self.assertTrue(np.array_equal(heights, self.world.render_world(4, engine="adaptive")))
+
+    def test_snapshot(self):
+        heights = self.world.render_world(4, engine="vector")
+        self.world.split(np.array((5., 11.)))
+        with tempfile.TemporaryDirectory() as directory:
+            self.world.save(directory, {"vector": heights})
+            loaded = world.World.load(directory)
+            self.assertTrue(np.array_equal(loaded.plates.coords, self.world.plates.coords))
+            self.assertTrue(np.array_equal(loaded.index.labels, self.world.index.labels))
+            self.assertEqual({loaded.plates.index(p) for p in loaded.dirty_plates},
+                             {self.world.plates.index(p) for p in self.world.dirty_plates})
+            self.assertTrue(np.array_equal(loaded.update_render(heights, 4, "vector"),
+                                           self.world.update_render(heights, 4, "vector")))
+
+            stored = snapshot.load_heightmap(directory, "vector")
+            self.assertIsInstance(stored, np.memmap)
+            self.assertTrue(np.array_equal(stored, heights))
+            self.assertEqual(snapshot.heightmap_names(directory), ["vector"])
+            del stored
+
+        # der Zufallsgenerator und die Grenzgeraden werden mitgespeichert: weitere Teilungen und Schritte ergeben dieselbe Welt.
+        for _ in range(3):
+            loaded.split()
+            self.world.split()
+            loaded.step(0.5)
+            self.world.step(0.5)
+        self.assertEqual(loaded.age, self.world.age)
+        self.assertEqual(loaded.time, self.world.time)
+        self.assertTrue(np.array_equal(loaded.plates.coords, self.world.plates.coords))
+
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.baseline = [{"name": "World.split", "size": 64, "splits": 1, "seconds": 1., "per_call": 1., "calls": 1,
+                          "peak_memory": 1000}]
+
+    def test_compare(self):
+        slower = [dict(self.baseline[0], per_call=1.5)]
+        self.assertEqual(len(benchmark.compare(slower, self.baseline, 0.2)), 1)
+        self.assertEqual(benchmark.compare(slower, self.baseline, 0.6), [])
+        self.assertEqual(benchmark.compare([dict(self.baseline[0], peak_memory=900)], self.baseline, 0.2), [])
+        # Benchmarks, die im Baseline fehlen, werden ignoriert
+        self.assertEqual(benchmark.compare([dict(slower[0], size=128)], self.baseline, 0.2), [])
+
+    def test_threshold_exit_code(self):
+        args = ["--sizes", "8", "--splits", "1", "--resolutions", "2", "--samples", "3", "--repeat", "1"]
+        with tempfile.TemporaryDirectory() as directory:
+            output, baseline = os.path.join(directory, "results.json"), os.path.join(directory, "baseline.json")
+            self.assertEqual(benchmark.main(args + ["--output", output]), 0)
+            with open(output) as f:
+                report = json.load(f)
+            with open(baseline, "w") as f:
+                json.dump(report, f)
+            self.assertEqual(benchmark.main(args + ["--output", output, "--baseline", baseline, "--threshold", "1000"]), 0)
+            # ein Baseline, das viel schneller war, führt zum Exit-Code 1
+            for result in report["results"]:
+                result["per_call"] /= 10**6
+            with open(baseline, "w") as f:
+                json.dump(report, f)
+            self.assertEqual(benchmark.main(args + ["--output", output, "--baseline", baseline]), 1)
@@ -1,39 +1,104 @@
 """Enthält alle Funktionen, die für nichts spezifisches gebraucht werden."""
 from __future__ import annotations
 # in order to allow class function argument specifiers to be its parent class
-from shapely.geometry import Polygon, Point
+from shapely.geometry import Polygon
 import numpy as np
 
 
+class EdgeTable:
+    """Die Kanten eines konvexen Polygons als Arrays. Wird einmal pro Platte berechnet (siehe Plate.edges) und danach
+    nicht mehr verändert, alle Arrays sind schreibgeschützt. Ändern sich die Eckpunkte, wird eine neue Tabelle erstellt.
+    Die Kante i verläuft von starts[i] nach ends[i] = vertices[(i+1) % e], gleich wie in getborderpointsbyvectors."""
+    __slots__ = ("starts", "ends", "vectors", "normals", "tolerances", "centroid")
+
+    def __init__(self, vertices: np.ndarray, eps: float = 1e-9):
+        """:param vertices: die Eckpunkte des Polygons, Form (e, 2).
+        :param eps: Toleranz für touches und contains, relativ zur Länge der Kanten (wie in points_on_polygon_border)."""
+        self.starts = np.array(vertices, dtype=float).reshape(-1, 2)
+        self.ends = np.roll(self.starts, -1, axis=0)
+        self.vectors = self.ends - self.starts
+        # die Normalen zeigen bei Polygonen im Gegenuhrzeigersinn nach innen
+        self.normals = np.stack([-self.vectors[:, 1], self.vectors[:, 0]], axis=1)
+        self.tolerances = eps*np.sqrt(np.einsum("ek,ek->e", self.vectors, self.vectors))
+        cross = self.starts[:, 0]*self.ends[:, 1] - self.ends[:, 0]*self.starts[:, 1]
+        area = cross.sum() / 2
+        if area != 0:
+            self.centroid = ((self.starts + self.ends)*cross[:, None]).sum(axis=0) / (6*area)
+        else:
+            self.centroid = self.starts.mean(axis=0)
+        for array in (self.starts, self.ends, self.vectors, self.normals, self.tolerances, self.centroid):
+            array.flags.writeable = False
+
+    def __len__(self):
+        return len(self.starts)
+
+    def touches(self, p: np.ndarray) -> bool:
+        """Gibt an, ob der Punkt :param p auf dem Rand liegt (wie points_on_polygon_border)."""
+        rel = np.asarray(p, dtype=float) - self.starts
+        cross = self.vectors[:, 0]*rel[:, 1] - self.vectors[:, 1]*rel[:, 0]
+        dot = np.einsum("ek,ek->e", rel, self.vectors)
+        length2 = np.einsum("ek,ek->e", self.vectors, self.vectors)
+        return bool(((np.abs(cross) <= self.tolerances) & (dot >= 0) & (dot <= length2)).any())
+
+    def contains(self, p: np.ndarray) -> bool:
+        """Gibt an, ob der Punkt :param p im Polygon oder auf dessen Rand liegt (wie points_in_convex_polygon)."""
+        rel = np.asarray(p, dtype=float) - self.starts
+        cross = self.vectors[:, 0]*rel[:, 1] - self.vectors[:, 1]*rel[:, 0]
+        return bool((cross >= -self.tolerances).all() or (cross <= self.tolerances).all())
+
+    def intersect_line(self, P: np.ndarray, v: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Schneidet die Gerade durch :param P mit Richtung :param v mit allen Kanten auf einmal (gleiche Formel wie
+        getPointOnLinesegment).
+        :returns: die Schnittpunkte, Form (e, 2), und für jede Kante, ob sie geschnitten wird."""
+        P1 = np.asarray(P)
+        P2 = P1 + v
+        R1, R2 = self.starts, self.ends
+        numerator = ((P1[0]-R1[:, 0])*(P1[1]-P2[1])-(P1[0]-P2[0])*(P1[1]-R1[:, 1]))
+        divisor = ((P1[0]-P2[0])*(R1[:, 1]-R2[:, 1])-(R1[:, 0]-R2[:, 0])*(P1[1]-P2[1]))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u = numerator / divisor
+            # bei parallelen Kanten ist u inf oder NaN, Q dann NaN
+            Q = R1 + u[:, None]*self.vectors
+        hit = (divisor != 0) & (u >= 0) & (u <= 1)
+        return Q, hit
+
+    def cast(self, P: np.ndarray, v: np.ndarray) -> tuple[int, np.ndarray | None]:
+        """Schneidet den Strahl :param P + λ * :param v (λ >= 0) mit allen Kanten auf einmal.
+        :returns: den Index der Kante, die der Strahl als erstes trifft, und den Schnittpunkt. Trifft er keine, (-1, None)."""
+        Q, hit = self.intersect_line(P, v)
+        hit &= (Q - P) @ v >= 0
+        if not hit.any():
+            return -1, None
+        i = int(np.argmin(np.where(hit, np.linalg.norm(Q - P, axis=1), np.inf)))
+        return i, Q[i]
+
+
 def getborderpointbyvector(p: np.ndarray[int | float, int | float],
                            v: np.ndarray[int | float, int | float],
-                           polygon: Polygon, threshold: float = 0.01) -> tuple[np.ndarray[int | float, int | float],
-                                                                               np.ndarray[int | float, int | float],
-                                                                               np.ndarray[int | float, int | float]]:
+                           polygon: Polygon | EdgeTable, threshold: float = 0.01) -> tuple[np.ndarray[int | float, int | float],
+                                                                                           np.ndarray[int | float, int | float],
+                                                                                           np.ndarray[int | float, int | float]]:
     """Findet den Punkt, wo der Strahl :param p + λ * :param v die Grenze des Polygons :param polygon schneidet.
     :returns: die Funktion gibt drei Punkte zurück. Diese sind der Punkt, wo der Strahl das Polygon schneidet, sowie die zwei Eckpunkte des Polygons zwischen welchen
               dieser Punkt liegt, in dieser Ordnung.
     :param p: definiert den Startpunkt des Strahls.
     :param v: definiert die Richtung des Strahls.
-    :param polygon: das wie oben definierte polygon.
+    :param polygon: das wie oben definierte polygon, am besten direkt als EdgeTable (siehe Plate.edges). Ein shapely-Polygon
+                    wird bei jedem Aufruf in eine EdgeTable umgewandelt.
     :param threshold: Definiert, wie nahe der zurückgegebene Punkt am richtigen Wert liegen soll.
     (Falls der Startpunkt auf der Grenze des Polygons liegt, verschiebt die Funktion diesen Punkt um diesen Wert zum Polygon hinzu, da es sonst zu Probleme führen könnte). """
+    edges = polygon if isinstance(polygon, EdgeTable) else EdgeTable(polygon.exterior.coords[:-1])
 
     # wenn der Punkt am Rand des Polygons ist, verschiebt man den etwas zur Mitte des Polygons.
-    if polygon.touches(Point(p)):
-        dvector = np.array(polygon.centroid)
+    if edges.touches(p):
+        dvector = edges.centroid - p
         p = p+threshold*2*(dvector / np.linalg.norm(dvector))
 
-    # Geht durch alle Eckpunktpaare, bis dieses gefunden wurde, zwischen welchen der Grenzpunkt liegt.
-    for i in range(len(polygon.exterior.coords)):
-        E1 = np.array(polygon.exterior.coords[i - 1])
-        E2 = np.array(polygon.exterior.coords[i])
-
-        # falls der Punkt nicht zwischen diesen Punkten liegt, gibt diese Funktion None zurück.
-        Q = getPointOnLinesegment(p, v, np.array(E1), np.array(E2))
-        if Q is not None:
-            if np.array(Q-p).dot(v) >= 0:
-                return Q, np.array(E1), np.array(E2)
+    # alle Kanten werden auf einmal geschnitten, genommen wird der nächste Schnittpunkt in Richtung des Strahls.
+    i, Q = edges.cast(p, v)
+    if i == -1:
+        return None
+    return Q, edges.starts[i].copy(), edges.ends[i].copy()
 
 
 def getPointOnLinesegment(P: np.ndarray[int | float, int | float],
@@ -72,3 +137,119 @@ def normalize_vector(v: np.ndarray[int | float, int | float]) -> np.ndarray[floa
         # falls der Vektor die Länge 0 hat, dann handelt es sich um den 0-vektor -> (0, 0)
         return v
     return v/len_v
+
+
+def getborderpointsbyvectors(points: np.ndarray, rays: np.ndarray, vertices: np.ndarray, threshold: float = 0.01,
+                             centroid: np.ndarray | None = None, pairwise: bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vektorisierte Version von getborderpointbyvector: schneidet alle Strahlen aller Punkte auf einmal mit allen Kanten
+    des Polygons.
+    :param points: Startpunkte der Strahlen, Form (n, 2).
+    :param rays: Richtungen der Strahlen, Form (r, 2). Jeder Punkt wird mit jedem Strahl kombiniert.
+    :param vertices: Eckpunkte des (konvexen) Polygons, Form (e, 2), in derselben Reihenfolge wie Plate.vertices.
+    :param threshold: siehe getborderpointbyvector.
+    :param centroid: Schwerpunkt des Polygons. Wird er nicht angegeben, wird er mit shapely berechnet.
+    :param pairwise: falls True, hat :param rays die Form (n, 2) und jeder Punkt wird nur mit seinem eigenen Strahl
+                     kombiniert. Die Resultate haben dann die Form (n, 2) bzw. (n,).
+    :returns: die Grenzpunkte (n, r, 2), den Index der getroffenen Kante (n, r) und die Distanz vom Startpunkt zum
+              Grenzpunkt (n, r). Die Kante i verläuft von vertices[i] nach vertices[(i+1) % e], gleich wie in
+              getborderpointbyvector. Wird keine Kante getroffen, ist der Index -1 und der Grenzpunkt NaN."""
+    points = np.asarray(points, dtype=float)
+    rays = np.asarray(rays, dtype=float)
+    vertices = np.asarray(vertices, dtype=float)
+    R1 = vertices
+    R2 = np.roll(vertices, -1, axis=0)
+
+    # wie in getborderpointbyvector werden Punkte auf dem Rand etwas verschoben.
+    on_border = points_on_polygon_border(points, vertices)
+    if on_border.any():
+        if centroid is None:
+            centroid = np.array(Polygon(vertices).centroid.coords[0])
+        points = points.copy()
+        dvector = centroid - points[on_border]
+        points[on_border] += threshold*2*(dvector / np.linalg.norm(dvector, axis=1)[:, None])
+
+    # Achsen: (Punkt, Strahl, Kante, Koordinate). Die Formeln sind dieselben wie in getPointOnLinesegment.
+    P1 = points[:, None, None, :]
+    v = rays[:, None, None, :] if pairwise else rays[None, :, None, :]
+    P2 = P1 + v
+    E1 = R1[None, None, :, :]
+    E2 = R2[None, None, :, :]
+
+    numerator = ((P1[..., 0]-E1[..., 0])*(P1[..., 1]-P2[..., 1])-(P1[..., 0]-P2[..., 0])*(P1[..., 1]-E1[..., 1]))
+    divisor = ((P1[..., 0]-P2[..., 0])*(E1[..., 1]-E2[..., 1])-(E1[..., 0]-E2[..., 0])*(P1[..., 1]-P2[..., 1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        u = numerator / divisor
+    hit = (divisor != 0) & (u >= 0) & (u <= 1)
+    Q = E1 + u[..., None]*(E2-E1)
+    hit &= np.einsum("...k,...k->...", Q-P1, v) >= 0
+
+    # wie in getborderpointbyvector wird der nächste Schnittpunkt in Richtung des Strahls genommen.
+    edge = np.argmin(np.where(hit, np.linalg.norm(Q - P1, axis=-1), np.inf), axis=-1)
+    found = hit.any(axis=-1)
+    edge = np.where(found, edge, -1)
+    border_points = np.take_along_axis(Q, np.maximum(edge, 0)[..., None, None], axis=2)[:, :, 0, :]
+    border_points[~found] = np.nan
+    distances = np.linalg.norm(border_points - points[:, None, :], axis=-1)
+    if pairwise:
+        return border_points[:, 0], edge[:, 0], distances[:, 0]
+    return border_points, edge, distances
+
+
+def points_on_polygon_border(points: np.ndarray, vertices: np.ndarray, eps: float = 1e-9) -> np.ndarray:
+    """Gibt für jeden Punkt an, ob er auf dem Rand des Polygons liegt (entspricht polygon.touches(Point(p))).
+    :param points: die Punkte, Form (n, 2).
+    :param vertices: die Eckpunkte des Polygons, Form (e, 2).
+    :param eps: Toleranz, relativ zur Länge der Kanten."""
+    points = np.asarray(points, dtype=float)
+    R1 = np.asarray(vertices, dtype=float)
+    d = np.roll(R1, -1, axis=0) - R1
+    rel = points[:, None, :] - R1[None, :, :]
+    cross = d[None, :, 0]*rel[..., 1] - d[None, :, 1]*rel[..., 0]
+    dot = np.einsum("nek,ek->ne", rel, d)
+    length2 = np.einsum("ek,ek->e", d, d)
+    return ((np.abs(cross) <= eps*np.sqrt(length2)) & (dot >= 0) & (dot <= length2)).any(axis=1)
+
+
+def points_in_convex_polygon(points: np.ndarray, vertices: np.ndarray, eps: float = 1e-9, strict: bool = False) -> np.ndarray:
+    """Gibt für jeden Punkt an, ob er im konvexen Polygon oder auf dessen Rand liegt
+    (entspricht polygon.contains(Point(p)) or polygon.touches(Point(p))).
+    Die Platten sind immer konvex, da sie nur entlang von Geraden geteilt werden.
+    :param points: die Punkte, Form (n, 2).
+    :param vertices: die Eckpunkte des Polygons, Form (e, 2). Die Orientierung spielt keine Rolle.
+    :param eps: Toleranz, relativ zur Länge der Kanten.
+    :param strict: falls True, zählen nur Punkte, die mindestens eps vom Rand entfernt im Polygon liegen."""
+    points = np.asarray(points, dtype=float)
+    R1 = np.asarray(vertices, dtype=float)
+    d = np.roll(R1, -1, axis=0) - R1
+    rel = points[:, None, :] - R1[None, :, :]
+    cross = d[None, :, 0]*rel[..., 1] - d[None, :, 1]*rel[..., 0]
+    tol = eps*np.sqrt(np.einsum("ek,ek->e", d, d))
+    if strict:
+        # Kanten der Länge 0 (doppelte Eckpunkte) werden ignoriert, sonst wäre kein Punkt strikt im Polygon.
+        tol = np.where(tol > 0, tol, -np.inf)
+        return (cross > tol).all(axis=1) | (cross < -tol).all(axis=1)
+    return (cross >= -tol).all(axis=1) | (cross <= tol).all(axis=1)
+
+
+def grid_in_convex_polygon(xs: np.ndarray, ys: np.ndarray, vertices: np.ndarray, eps: float = 1e-9, strict: bool = False) -> np.ndarray:
+    """Wie points_in_convex_polygon, aber für alle Punkte (x, y) eines Gitters. Gibt ein Array der Form (len(xs), len(ys))
+    zurück, ohne die Punkte des Gitters einzeln zu erzeugen: pro Kante wird nur eine Spalte und eine Zeile berechnet.
+    :param xs: / :param ys: die Koordinaten des Gitters."""
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    R1 = np.asarray(vertices, dtype=float)
+    d = np.roll(R1, -1, axis=0) - R1
+    tol = eps*np.sqrt(np.einsum("ek,ek->e", d, d))
+    if strict:
+        tol = np.where(tol > 0, tol, -np.inf)
+    positive = np.ones((len(xs), len(ys)), dtype=bool)
+    negative = np.ones((len(xs), len(ys)), dtype=bool)
+    for (x, y), (dx, dy), t in zip(R1, d, tol):
+        cross = dx*(ys - y)[None, :] - dy*(xs - x)[:, None]
+        if strict:
+            positive &= cross > t
+            negative &= cross < -t
+        else:
+            positive &= cross >= -t
+            negative &= cross <= t
+    return positive | negative
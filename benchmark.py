@@ -0,0 +1,168 @@
+"""Benchmarks für die langsamen Teile der Welt-Generierung.
+
+Beispiele:
+    python benchmark.py --preset quick --output results.json
+    python benchmark.py --preset quick --baseline results.json --threshold 0.2
+
+Mit --baseline werden die Resultate mit einem früheren Lauf verglichen. Ist ein Benchmark um mehr als --threshold
+(relativ) langsamer geworden, endet das Programm mit dem Exit-Code 1."""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import warnings
+from typing import Callable
+
+import numpy as np
+
+import assets
+from plates import create_rays
+from world import World
+
+PRESETS = {
+    "quick": {"sizes": [64, 128], "splits": [1, 20], "resolutions": [6]},
+    "full": {"sizes": [64, 128, 256, 512, 1024], "splits": [1, 10, 100, 500], "resolutions": [4, 6, 12]},
+}
+
+
+def make_world(size: int, splits: int, seed: int) -> World:
+    """Erstellt eine Welt der Grösse size x size mit :param splits Teilungen. Mit demselben Seed entsteht immer dieselbe Welt."""
+    world = World((size, size), seed=seed)
+    for _ in range(splits):
+        world.split()
+    return world
+
+
+def measure(func: Callable[..., object], repeat: int, setup: Callable[[], object] | None = None) -> tuple[float, int]:
+    """Gibt die beste Zeit aus :param repeat Durchläufen und den maximalen Speicherverbrauch (in Bytes) von :param func zurück.
+    Der Speicher wird in einem separaten Durchlauf gemessen, da tracemalloc die Zeitmessung verfälschen würde.
+    :param setup: falls angegeben, wird es vor jedem Durchlauf aufgerufen und sein Resultat an :param func übergeben.
+                  Die Zeit und der Speicher von setup werden nicht mitgemessen."""
+    arguments = (lambda: ()) if setup is None else (lambda: (setup(),))
+    best = float("inf")
+    for _ in range(repeat):
+        args = arguments()
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+
+    args = arguments()
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(sizes: list[int], splits: list[int], resolutions: list[int], samples: int = 200, repeat: int = 3,
+                   seed: int = 0, engines: tuple[str, ...] = ("vector",)) -> list[dict]:
+    """Führt alle Benchmarks für alle Kombinationen aus Grösse, Anzahl Teilungen und Auflösung aus.
+    :param samples: wie viele zufällige Punkte für die Benchmarks einzelner Aufrufe verwendet werden
+    :param repeat: wie oft jeder Benchmark wiederholt wird (die beste Zeit zählt)
+    :param engines: mit welchen Engines render_world gemessen wird"""
+    results = []
+
+    def record(name: str, seconds: float, peak: int, calls: int, **case) -> None:
+        results.append({"name": name, **case, "seconds": seconds, "per_call": seconds / calls, "calls": calls,
+                        "peak_memory": peak})
+        print(f"{name:30} {json.dumps(case):60} {seconds:10.4f}s  {peak / 2**20:8.2f} MiB", file=sys.stderr)
+
+    for size in sizes:
+        seconds, peak = measure(lambda: World((size, size), seed=seed), repeat)
+        record("World", seconds, peak, 1, size=size)
+        for n in splits:
+            # die Welten werden ausserhalb der Zeitmessung erstellt, sonst ginge split im Aufbau des PlateIndex unter.
+            seconds, peak = measure(lambda world: [world.split() for _ in range(n)], repeat,
+                                    setup=lambda: World((size, size), seed=seed))
+            record("World.split", seconds, peak, max(n, 1), size=size, splits=n)
+            seconds, peak = measure(lambda world: world.generate(n, seed), repeat, setup=lambda: World((size, size)))
+            record("World.generate", seconds, peak, max(n, 1), size=size, splits=n)
+
+            world = make_world(size, n, seed)
+            points = np.random.default_rng(seed).uniform(0, size, (samples, 2))
+
+            seconds, peak = measure(lambda: [world.getPlate(p) for p in points], repeat)
+            record("World.getPlate", seconds, peak, samples, size=size, splits=n)
+
+            tables = [(p, world.getPlate(p).edges) for p in points]
+            rays = create_rays(6)
+            seconds, peak = measure(lambda: [assets.getborderpointbyvector(p, ray, edges, 0.001)
+                                             for p, edges in tables for ray in rays], repeat)
+            record("assets.getborderpointbyvector", seconds, peak, samples * len(rays), size=size, splits=n)
+
+            for res in resolutions:
+                seconds, peak = measure(lambda: [world.getPointHeight(p, res) for p in points], repeat)
+                record("World.getPointHeight", seconds, peak, samples, size=size, splits=n, res=res)
+
+                for engine in engines:
+                    seconds, peak = measure(lambda: world.render_world(res, engine=engine), repeat)
+                    record("World.render_world", seconds, peak, 1, size=size, splits=n, res=res, engine=engine)
+
+    return results
+
+
+def _key(result: dict) -> tuple:
+    return tuple(sorted((k, v) for k, v in result.items() if k not in ("seconds", "per_call", "calls", "peak_memory")))
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[str]:
+    """Vergleicht die Resultate mit einem früheren Lauf und gibt eine Beschreibung jeder Verschlechterung zurück, die grösser
+    als :param threshold ist (0.2 = 20% langsamer oder 20% mehr Speicher). Benchmarks, die im Baseline fehlen, werden ignoriert."""
+    old = {_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        reference = old.get(_key(result))
+        if reference is None:
+            continue
+        for field in ("per_call", "peak_memory"):
+            if reference[field] > 0 and result[field] > reference[field] * (1 + threshold):
+                regressions.append(f"{result['name']} {dict(_key(result))}: {field} {reference[field]:.6g} -> {result[field]:.6g} "
+                                   f"(+{result[field] / reference[field] - 1:.0%})")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--preset", choices=PRESETS, default="quick")
+    parser.add_argument("--sizes", type=int, nargs="+", help="überschreibt die Grössen des Presets")
+    parser.add_argument("--splits", type=int, nargs="+", help="überschreibt die Anzahl Teilungen des Presets")
+    parser.add_argument("--resolutions", type=int, nargs="+", help="überschreibt die Strahlenanzahl des Presets")
+    parser.add_argument("--engines", nargs="+", default=["vector"], help="Engines für render_world")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Datei für die Resultate als JSON (sonst stdout)")
+    parser.add_argument("--baseline", help="JSON-Datei eines früheren Laufs zum Vergleichen")
+    parser.add_argument("--threshold", type=float, default=0.2, help="erlaubte relative Verschlechterung")
+    args = parser.parse_args(argv)
+
+    preset = PRESETS[args.preset]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        results = run_benchmarks(args.sizes or preset["sizes"], args.splits or preset["splits"],
+                                 args.resolutions or preset["resolutions"], args.samples, args.repeat, args.seed,
+                                 tuple(args.engines))
+
+    report = {"seed": args.seed, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print("REGRESSION:", regression, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
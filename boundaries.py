@@ -0,0 +1,167 @@
+"""Die Geraden, entlang derer die Platten geteilt wurden, und wie sie sich mit dem Drift der Platten verschieben."""
+from __future__ import annotations
+
+import numpy as np
+from typing import Iterable, Sequence
+from plates import Plate, PlateSet
+
+# kleiner darf eine Platte durch den Drift nicht werden. Eine Gerade, die eine Platte kleiner machen würde, bleibt in
+# diesem Schritt stehen.
+MIN_PLATE_AREA = 1e-3
+
+
+class BoundaryLines:
+    """Die Welt wird nur entlang von Geraden geteilt (siehe Plate.split). Jede Platte ist deshalb das Rechteck der Welt,
+    geschnitten mit den Halbebenen der Geraden, entlang derer sie und ihre Vorfahren geteilt wurden.
+    Eine Gerade ist n·x = c mit der Einheitsnormale n (normals) und c (offsets). Eine Platte liegt entweder auf der Seite
+    n·x >= c (Vorzeichen 1) oder auf der Seite n·x <= c (Vorzeichen -1). Welche Geraden zu einer Platte gehören, steht in
+    constraints.
+    Beim Teilen einer Platte bewegt sich die neue Gerade mit dem Driftvektor der geteilten Platte (senkrecht zur Geraden,
+    speeds). Die zwei neuen Platten driften von dort aus in entgegengesetzte Richtungen (siehe Plate.split).
+    Platten, deren Geschichte nicht bekannt ist (z.B. die erste Platte einer Welt), bekommen feste Geraden entlang ihrer
+    Kanten. Nach World.split muss split aufgerufen werden."""
+    def __init__(self, plates: Iterable[Plate], size: tuple[int, int]):
+        self.size = size
+        self.normals = np.empty((0, 2))
+        self.offsets = np.empty(0)
+        self.speeds = np.empty(0)
+        self.constraints: dict[Plate, tuple[np.ndarray, np.ndarray]] = {}
+        for plate in plates:
+            self.add_fixed(plate)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add_fixed(self, plate: Plate) -> None:
+        """Beschreibt :param plate durch feste Geraden entlang ihrer Kanten."""
+        vertices = plate.vertex_array
+        d = np.roll(vertices, -1, axis=0) - vertices
+        lengths = np.linalg.norm(d, axis=1)
+        keep = lengths > 0
+        normals = np.stack([-d[keep, 1], d[keep, 0]], axis=1) / lengths[keep, None]
+        offsets = np.einsum("ek,ek->e", normals, vertices[keep])
+        # da die Platte konvex ist, liegt der Mittelwert ihrer Eckpunkte auf der Innenseite aller Kanten.
+        signs = np.where(normals @ vertices.mean(axis=0) >= offsets, 1, -1)
+        self.constraints[plate] = (self._add(normals, offsets, np.zeros(len(offsets))), signs)
+
+    def split(self, old: Plate, new_plates: Sequence[Plate], point: np.ndarray) -> None:
+        """Führt die Geraden nach dem Teilen der Platte :param old nach (Parameter wie bei topology.Adjacency.split)."""
+        P = np.asarray(old.Plate_point, dtype=float)
+        R = np.asarray(point, dtype=float)
+        midpoint = R + (P-R)*0.5
+        normal = (P - R) / np.linalg.norm(P - R)
+        line = self._add(normal[None], np.array([normal @ midpoint]), np.array([normal @ old.drift_vector]))
+        lines, signs = self.constraints.pop(old)
+        for child in new_plates:
+            sign = 1 if (np.asarray(child.Plate_point) - midpoint) @ normal > 0 else -1
+            self.constraints[child] = (np.concatenate([lines, line]), np.append(signs, sign))
+
+    def _add(self, normals: np.ndarray, offsets: np.ndarray, speeds: np.ndarray) -> np.ndarray:
+        first = len(self.offsets)
+        self.normals = np.concatenate([self.normals, normals])
+        self.offsets = np.concatenate([self.offsets, offsets])
+        self.speeds = np.concatenate([self.speeds, speeds])
+        return np.arange(first, len(self.offsets), dtype=np.intp)
+
+    def advance(self, plates: Iterable[Plate], dt: float) -> dict[Plate, np.ndarray]:
+        """Verschiebt alle Geraden um :param dt mal ihre Geschwindigkeit und gibt die neuen Eckpunkte aller Platten zurück,
+        die sich dadurch verändert haben. Neu berechnet werden nur Platten, zu denen eine verschobene Gerade gehört.
+        Würde eine Platte kleiner als MIN_PLATE_AREA, bleiben die Geraden, die sich in sie hinein verschieben, in diesem
+        Schritt stehen."""
+        offsets = self.offsets + dt*self.speeds
+        moved = offsets != self.offsets
+        pending = [plate for plate in plates if moved[self.constraints[plate][0]].any()]
+        result = {}
+        while pending:
+            polygons = _clip(self.size, self.normals, offsets, [self.constraints[plate] for plate in pending])
+            shrinking = []
+            for plate, vertices in zip(pending, polygons):
+                if vertices is None:
+                    # die Geraden, die sich in die Platte hinein verschieben
+                    lines, signs = self.constraints[plate]
+                    shrinking.append(lines[signs*(offsets[lines] - self.offsets[lines]) > 0])
+                else:
+                    result[plate] = vertices
+            if not shrinking:
+                break
+            # diese Geraden bleiben stehen. Neu berechnet werden alle Platten, zu denen eine von ihnen gehört.
+            blocked = np.zeros(len(offsets), dtype=bool)
+            blocked[np.concatenate(shrinking)] = True
+            offsets[blocked] = self.offsets[blocked]
+            moved &= ~blocked
+            affected = [plate for plate in result if blocked[self.constraints[plate][0]].any()]
+            for plate in affected:
+                del result[plate]
+            pending = [plate for plate in affected + [p for p in pending if p not in result]
+                       if moved[self.constraints[plate][0]].any()]
+        self.offsets = offsets
+        changed = {}
+        for plate, vertices in result.items():
+            old = plate.vertex_array
+            if vertices.shape != old.shape or not np.array_equal(vertices, old):
+                changed[plate] = vertices
+        return changed
+
+    def as_arrays(self, plates: PlateSet) -> dict[str, np.ndarray]:
+        """Gibt die Geraden und die Geraden jeder Platte (in der Reihenfolge von :param plates) als flache Arrays zurück."""
+        constraints = [self.constraints[plate] for plate in plates]
+        return {"normals": self.normals, "offsets": self.offsets, "speeds": self.speeds,
+                "pointers": np.cumsum([0] + [len(lines) for lines, _ in constraints]).astype(np.int64),
+                "lines": np.concatenate([lines for lines, _ in constraints] + [np.empty(0, dtype=np.intp)]).astype(np.int64),
+                "signs": np.concatenate([signs for _, signs in constraints] + [np.empty(0, dtype=np.intp)]).astype(np.int8)}
+
+    @classmethod
+    def from_arrays(cls, plates: PlateSet, size: tuple[int, int], normals: np.ndarray, offsets: np.ndarray, speeds: np.ndarray,
+                    pointers: np.ndarray, lines: np.ndarray, signs: np.ndarray) -> BoundaryLines:
+        """Umkehrung von as_arrays."""
+        boundaries = cls((), size)
+        boundaries.normals = np.array(normals, dtype=float).reshape(-1, 2)
+        boundaries.offsets = np.array(offsets, dtype=float)
+        boundaries.speeds = np.array(speeds, dtype=float)
+        lines, signs = np.asarray(lines, dtype=np.intp), np.asarray(signs, dtype=np.intp)
+        for i, plate in enumerate(plates):
+            boundaries.constraints[plate] = (lines[pointers[i]:pointers[i+1]], signs[pointers[i]:pointers[i+1]])
+        return boundaries
+
+
+def _clip(size: tuple[int, int], normals: np.ndarray, offsets: np.ndarray,
+          constraints: list[tuple[np.ndarray, np.ndarray]]) -> list[np.ndarray | None]:
+    # schneidet für jede Platte das Rechteck der Welt mit ihren Halbebenen sign*(n·x - c) >= 0 (Sutherland-Hodgman), alle
+    # Platten gleichzeitig. Die Polygone liegen dazu aufgefüllt in einem Array der Form (Platten, Eckpunkte, 2), count gibt
+    # an, wie viele Eckpunkte gültig sind. Gibt für Platten, deren Fläche kleiner als MIN_PLATE_AREA wird, None zurück.
+    n = len(constraints)
+    depth = max((len(lines) for lines, _ in constraints), default=0)
+    # aufgefüllt wird mit der Halbebene 0·x + 1 >= 0, die alles enthält.
+    line_normals = np.zeros((n, depth, 2))
+    line_offsets = np.full((n, depth), -1.)
+    for i, (lines, signs) in enumerate(constraints):
+        line_normals[i, :len(lines)] = normals[lines] * signs[:, None]
+        line_offsets[i, :len(lines)] = offsets[lines] * signs
+
+    polygon = np.broadcast_to(np.array([(0., 0.), (0., size[1]), (size[0], size[1]), (size[0], 0.)]), (n, 4, 2))
+    count = np.full(n, 4)
+    rows = np.arange(n)[:, None]
+    for k in range(depth):
+        slots = np.arange(polygon.shape[1])[None]
+        valid = slots < count[:, None]
+        following = np.where(slots + 1 < count[:, None], slots + 1, 0)
+        d = polygon[..., 0]*line_normals[:, k, None, 0] + polygon[..., 1]*line_normals[:, k, None, 1] - line_offsets[:, k, None]
+        d_next = d[rows, following]
+        # Eckpunkte genau auf der Geraden werden nicht doppelt eingefügt.
+        keep = valid & (d >= 0)
+        cross = valid & (((d > 0) & (d_next < 0)) | ((d < 0) & (d_next > 0)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(cross, d / (d - d_next), 0.)
+        crossing = polygon + t[..., None]*(polygon[rows, following] - polygon)
+        # jeder Eckpunkt wird (falls er bleibt) von seinem Schnittpunkt mit der Geraden gefolgt (falls es einen gibt).
+        candidates = np.stack([polygon, crossing], axis=2).reshape(n, -1, 2)
+        mask = np.stack([keep, cross], axis=2).reshape(n, -1)
+        count = mask.sum(axis=1)
+        order = np.argsort(~mask, axis=1, kind="stable")[:, :max(count.max(), 1)]
+        polygon = candidates[rows, order]
+
+    slots = np.arange(polygon.shape[1])[None]
+    following = np.where(slots + 1 < count[:, None], slots + 1, 0)
+    x, y = np.where(slots < count[:, None], polygon[..., 0], 0), np.where(slots < count[:, None], polygon[..., 1], 0)
+    area = np.abs((x*y[rows, following] - x[rows, following]*y).sum(axis=1)) / 2
+    return [polygon[i, :count[i]].copy() if count[i] >= 3 and area[i] >= MIN_PLATE_AREA else None for i in range(n)]
@@ -0,0 +1,84 @@
+"""Verschobene Kopien ("Geister") der Platten am Rand der Welt, damit die Welt an den Rändern nahtlos weitergeht."""
+from __future__ import annotations
+
+import numpy as np
+from plates import Plate, PlateSet
+
+
+class GhostLayer:
+    """Die Welt ist ein Torus: wer sie links verlässt, kommt rechts wieder herein. Für jede Platte, die den Rand der Welt
+    berührt, wird deshalb eine um die Breite bzw. Höhe der Welt verschobene Kopie auf der anderen Seite gespeichert
+    (an den Ecken auch diagonal). Damit liegt jeder Punkt knapp ausserhalb der Welt in einer Geisterplatte, und man muss
+    ihn nicht erst mit Modulo in die Welt zurückholen.
+    Die Geister werden über den Index ihrer Platte in der Plattenliste gespeichert und müssen wie der PlateIndex nach
+    jedem World.split nachgeführt werden."""
+    def __init__(self, plates: PlateSet, size: tuple[int, int], tol: float = 1e-9):
+        self.plates = plates
+        self.size = size
+        self.tol = tol
+        self.plate_ids = np.empty(0, dtype=np.intp)
+        self.offsets = np.empty((0, 2))
+        self.bboxes = np.empty((0, 4))
+        self.vertices: list[np.ndarray] = []
+        self.rebuild()
+
+    def __len__(self):
+        return len(self.plate_ids)
+
+    def rebuild(self) -> None:
+        """Erstellt alle Geister neu."""
+        self.plate_ids = np.empty(0, dtype=np.intp)
+        self.offsets = np.empty((0, 2))
+        self.bboxes = np.empty((0, 4))
+        self.vertices = []
+        for i in range(len(self.plates)):
+            self._add(i)
+
+    def split(self, old_index: int) -> None:
+        """Führt die Geister nach World.split nach (siehe PlateIndex.split)."""
+        keep = self.plate_ids != old_index
+        self.plate_ids = self.plate_ids[keep]
+        self.plate_ids[self.plate_ids > old_index] -= 1
+        self.offsets = self.offsets[keep]
+        self.bboxes = self.bboxes[keep]
+        self.vertices = [v for v, k in zip(self.vertices, keep) if k]
+        self._add(len(self.plates)-2)
+        self._add(len(self.plates)-1)
+
+    def update(self, rows: np.ndarray) -> None:
+        """Erstellt die Geister der Platten :param rows neu, nachdem sich ihre Eckpunkte verändert haben."""
+        keep = ~np.isin(self.plate_ids, rows)
+        self.plate_ids = self.plate_ids[keep]
+        self.offsets = self.offsets[keep]
+        self.bboxes = self.bboxes[keep]
+        self.vertices = [v for v, k in zip(self.vertices, keep) if k]
+        for i in rows:
+            self._add(i)
+
+    def ghost_offsets(self, plate: Plate) -> list[tuple[float, float]]:
+        """Gibt zurück, um welche Vektoren die Geister einer Platte verschoben sind."""
+        vertices = plate.vertex_array
+        lo, hi = vertices.min(axis=0), vertices.max(axis=0)
+        dx = [0.]
+        dy = [0.]
+        # eine Platte am linken Rand erscheint auch rechts der Welt, eine am rechten Rand auch links davon usw.
+        if lo[0] <= self.tol:
+            dx.append(float(self.size[0]))
+        if hi[0] >= self.size[0] - self.tol:
+            dx.append(-float(self.size[0]))
+        if lo[1] <= self.tol:
+            dy.append(float(self.size[1]))
+        if hi[1] >= self.size[1] - self.tol:
+            dy.append(-float(self.size[1]))
+        return [(x, y) for x in dx for y in dy if x or y]
+
+    def _add(self, index: int) -> None:
+        vertices = self.plates[index].vertex_array
+        offsets = self.ghost_offsets(self.plates[index])
+        if not offsets:
+            return
+        offsets = np.array(offsets)
+        self.plate_ids = np.concatenate([self.plate_ids, np.full(len(offsets), index, dtype=np.intp)])
+        self.offsets = np.concatenate([self.offsets, offsets])
+        self.vertices.extend(vertices + offset for offset in offsets)
+        self.bboxes = np.concatenate([self.bboxes, np.concatenate([vertices.min(axis=0) + offsets, vertices.max(axis=0) + offsets], axis=1)])
@@ -1,37 +1,128 @@
 """Sammlung der Höhenfunktionen für die Punkte"""
+from __future__ import annotations
+
 import numpy as np
 import plates
 
 
+# Die Art der Interaktion zwischen zwei Platten bestimmt die Relieffunktion. Aus der Sicht von plate1:
+K_DIV_K = 0  # kontinental-kontinental divergent
+O_DIV_O = 1  # ozeanisch-ozeanisch divergent
+K_KON_O = 2  # plate1 kontinental, plate2 ozeanisch, konvergent
+O_KON_K = 3  # plate1 ozeanisch, plate2 kontinental, konvergent
+K_KON_K = 4  # kontinental-kontinental konvergent
+O_KON_O = 5  # ozeanisch-ozeanisch konvergent
+
+
+class Interaction:
+    """Alles, was für die Höhe an einer Grenze nur von den zwei Platten und der gemeinsamen Kante abhängt."""
+    __slots__ = ("u1", "u2", "T", "div", "code")
+
+    def __init__(self, u1: np.ndarray, u2: np.ndarray, T: float, div: bool, code: int):
+        self.u1 = u1
+        self.u2 = u2
+        self.T = T
+        self.div = div
+        self.code = code
+
+
+def get_interaction(plate1: plates.Plate, plate2: plates.Plate,
+                    shared_border: tuple[np.ndarray[int | float, int | float], np.ndarray[int | float, int | float]]) -> Interaction:
+    """Bestimmt, wie die zwei Platten an der Grenze :param shared_border interagieren und welche Relieffunktion dazu gehört.
+    Die Parameter sind dieselben wie bei get_height_func."""
+    u1, u2 = get_drift_vector_relations(plate1, plate2, shared_border)
+    T = get_T_value(u1, u2) * .005
+    div = is_div(plate1, plate2, u1, u2)
+    if div:
+        code = K_DIV_K if plate1.PType == "K" else O_DIV_O
+    elif plate1.PType != plate2.PType:
+        code = K_KON_O if plate1.PType == "K" else O_KON_K
+    else:
+        code = K_KON_K if plate1.PType == "K" else O_KON_O
+    return Interaction(u1, u2, T, div, code)
+
+
+def evaluate_relief(code: int, T: int | float, x):
+    """Setzt den (schon skalierten) Wert x in die Relieffunktion der Interaktion :param code ein."""
+    if code == K_DIV_K:
+        return K_div_K(T, x)
+    elif code == O_DIV_O:
+        return O_div_O(T, x)
+    elif code == K_KON_O:
+        return K_kon_O(T, -x)+1
+    elif code == O_KON_K:
+        return K_kon_O(T, x)
+    elif code == K_KON_K:
+        return K_kon_K(T, x)
+    else:
+        return O_kon_O(T, x)
+
+
+class InteractionTable:
+    """Speichert die Interaktionen pro (plate1, plate2, Kante), damit sie nicht für jeden Strahl neu berechnet werden.
+    Wird eine Platte verändert oder entfernt, müssen ihre Einträge mit invalidate gelöscht werden."""
+    def __init__(self):
+        self.entries: dict[tuple, Interaction] = {}
+        self._keys_by_plate: dict[plates.Plate, set[tuple]] = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, plate1: plates.Plate, plate2: plates.Plate,
+            shared_border: tuple[np.ndarray[int | float, int | float], np.ndarray[int | float, int | float]]) -> Interaction:
+        """Gibt die Interaktion zurück und berechnet sie, falls sie noch nicht in der Tabelle ist."""
+        key = (plate1, plate2, tuple(map(float, shared_border[0])), tuple(map(float, shared_border[1])))
+        interaction = self.entries.get(key)
+        if interaction is None:
+            interaction = get_interaction(plate1, plate2, (np.asarray(shared_border[0]), np.asarray(shared_border[1])))
+            self.entries[key] = interaction
+            self._keys_by_plate.setdefault(plate1, set()).add(key)
+            self._keys_by_plate.setdefault(plate2, set()).add(key)
+        return interaction
+
+    def invalidate(self, plate: plates.Plate) -> None:
+        """Löscht alle Einträge, an denen :param plate beteiligt ist."""
+        for key in self._keys_by_plate.pop(plate, ()):
+            self.entries.pop(key, None)
+            other = key[1] if key[0] is plate else key[0]
+            if other in self._keys_by_plate:
+                self._keys_by_plate[other].discard(key)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self._keys_by_plate.clear()
+
+
 def get_height_func(x, plate1: plates.Plate, plate2: plates.Plate,
-                    shared_border: tuple[np.ndarray[int | float, int | float], np.ndarray[int | float, int | float]]) -> float:
+                    shared_border: tuple[np.ndarray[int | float, int | float], np.ndarray[int | float, int | float]],
+                    table: InteractionTable | None = None) -> float:
     """Teilt den Interaktionen zwischen zwei Platten eine Relieffunktion zu und setzt dann den Wert x dafür ein.
     :param x: Der Wert, der in die Formel eingesetzt wird.
     :param plate1: Eine der oben erwähnten Platten. Es wird angenommen, dass der Wert, von welchem der x-Wert stammt, in dieser Platte enthalten ist.
     :param plate2: Die zweite der oben erwähnten Platten.
-    :param shared_border: Definiert die Grenze, welche plate1 von plate2 separiert."""
+    :param shared_border: Definiert die Grenze, welche plate1 von plate2 separiert.
+    :param table: falls angegeben, wird die Interaktion der Platten dort nachgeschaut, statt sie neu zu berechnen."""
 
-    u1, u2 = get_drift_vector_relations(plate1, plate2, shared_border)
-    T = get_T_value(u1, u2) * .005
+    if table is not None:
+        interaction = table.get(plate1, plate2, shared_border)
+    else:
+        interaction = get_interaction(plate1, plate2, shared_border)
     x *= .05
-    if is_div(plate1, plate2, u1, u2):
-        if plate1.PType == "K":
-            return K_div_K(T, x)
-        else:
-            return O_div_O(T, x)
+    return evaluate_relief(interaction.code, interaction.T, x)
 
-    else:
-        if plate1.PType != plate2.PType:
-            if plate1.PType == "K":
-                return K_kon_O(T, -x)+1
-            else:
-                return K_kon_O(T, x)
 
-        else:
-            if plate1.PType == "K":
-                return K_kon_K(T, x)
-            else:
-                return O_kon_O(T, x)
+def get_height_array(x: np.ndarray, T: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """Array-Version von get_height_func: jede Relieffunktion wird nur einmal mit allen Werten ihrer Interaktionsart aufgerufen.
+    Die Resultate sind genau dieselben wie bei get_height_func.
+    :param x: die Werte, die in die Formeln eingesetzt werden (wie bei get_height_func)
+    :param T: die T-Werte der Interaktionen (Interaction.T), gleiche Form wie x
+    :param codes: die Interaktionsarten (Interaction.code), gleiche Form wie x"""
+    x, T, codes = np.broadcast_arrays(np.asarray(x, dtype=float) * .05, T, codes)
+    out = np.empty(x.shape)
+    for code in np.unique(codes):
+        group = codes == code
+        out[group] = evaluate_relief(code, T[group], x[group])
+    return out
 
 
 def get_drift_vector_relations(plate1: plates.Plate, plate2: plates.Plate,
@@ -103,6 +194,28 @@ def get_rayvector_components(start_point: np.ndarray[int | float, int | float],
     return distance, weight
 
 
+def get_rayvector_components_array(start_points: np.ndarray, border_points: np.ndarray,
+                                   E1: np.ndarray, E2: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Array version of get_rayvector_components. All arguments broadcast against each other, the last axis holds the coordinates.
+    :param start_points: The starting points of the rays
+    :param border_points: The points where the rays cross the plate boundary
+    :param E1: first points of the crossed edges
+    :param E2: second points of the crossed edges"""
+
+    raw = border_points-start_points
+    d = E1-E2
+
+    # rotate by 90°
+    u = np.stack([-d[..., 1], d[..., 0]], axis=-1)
+    u = np.where((np.einsum("...k,...k->...", raw, u) < 0)[..., None], -u, u)
+
+    # normalize vector
+    u = u/np.linalg.norm(u, axis=-1)[..., None]
+    distance = np.einsum("...k,...k->...", raw, u)
+    weight = np.arccos(np.abs(distance) / np.linalg.norm(raw, axis=-1))
+    return distance, weight
+
+
 def K_div_K(T: int | float, x: int | float) -> float:
     """Relieffunktion kontinental-kontinental divergent"""
     return 1 / (1 + np.exp(4 * (-x + 4 * T)/T)) + np.exp(-25*x**2)/10
@@ -0,0 +1,81 @@
+"""Zeitmessung und Fortschrittsanzeige fürs Rendern."""
+from __future__ import annotations
+
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, ContextManager, Iterator
+
+
+class RenderStats:
+    """Sammelt, wie viel Zeit in welchem Schritt des Renderns verbracht wurde, und zählt, wie oft etwas passiert ist.
+    Die Schritte heissen "plate_lookup", "intersection", "neighbour_lookup", "height_function" und "weighted_average".
+    Ist enabled False, kosten stage und count (fast) nichts."""
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.timers: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+
+    def stage(self, name: str) -> ContextManager:
+        """Misst die Zeit des with-Blocks und zählt sie zum Timer :param name hinzu."""
+        if not self.enabled:
+            return nullcontext()
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.) + time.perf_counter() - start
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Zählt den Zähler :param name um :param n hoch."""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def merge(self, other: RenderStats | dict) -> None:
+        """Zählt die Timer und Zähler von :param other (z.B. von einem anderen Prozess) hinzu."""
+        other = other.as_dict() if isinstance(other, RenderStats) else other
+        for name, seconds in other["timers"].items():
+            self.timers[name] = self.timers.get(name, 0.) + seconds
+        for name, n in other["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self) -> dict:
+        return {"timers": dict(self.timers), "counters": dict(self.counters)}
+
+    def __repr__(self):
+        return f"RenderStats({self.as_dict()})"
+
+
+# wird verwendet, wenn niemand an der Zeitmessung interessiert ist.
+NO_STATS = RenderStats(enabled=False)
+
+
+class Progress:
+    """Ruft :param callback mit (erledigt, total) auf, aber höchstens alle :param interval Sekunden (und sicher am Ende)."""
+    def __init__(self, callback: Callable[[int, int], None] | None, total: int, interval: float = 0.5):
+        self.callback = callback
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self._last = float("-inf")
+
+    def update(self, n: int = 1) -> None:
+        self.done += n
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if now - self._last >= self.interval or self.done >= self.total:
+            self._last = now
+            self.callback(self.done, self.total)
+
+
+def print_progress(done: int, total: int) -> None:
+    """Ein einfacher Callback für Progress, der den Fortschritt im Terminal anzeigt."""
+    sys.stderr.write(f"\r{done}/{total} ({done / max(total, 1):.0%})")
+    if done >= total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
@@ -0,0 +1,158 @@
+"""Räumlicher Index, der Punkten schnell ihre Platte zuordnet."""
+from __future__ import annotations
+
+import numpy as np
+import assets
+from plates import Plate, PlateSet
+from ghosts import GhostLayer
+
+
+class PlateIndex:
+    """Ordnet Punkte den Platten einer Welt zu, ohne alle Platten durchzuloopen.
+    Die Welt wird in Zellen der Grösse 1x1 gerastert. Für jede Zelle, die vollständig in einer Platte liegt, wird die
+    Platte gespeichert, für alle anderen Zellen (die also von einer Grenze geschnitten werden) keine. Punkte in solchen
+    Zellen oder ausserhalb des Rasters werden exakt bestimmt, wobei nur die Platten geprüft werden, deren Bounding-Box den
+    Punkt enthält. Punkte knapp ausserhalb der Welt werden über die Geisterplatten (siehe ghosts.GhostLayer) ihrer Platte
+    zugeordnet.
+    Im Raster steht nicht der Index der Platte in der Plattenliste, sondern eine feste Nummer (ab 1, 0 = keine Platte), die
+    über self.rows in den aktuellen Index übersetzt wird. So muss bei einem split nur die Bounding-Box der alten Platte
+    angeschaut werden, obwohl sich die Indizes aller folgenden Platten verschieben.
+    Der Index hält eine Referenz auf die Plattenliste der Welt und muss nach jeder Änderung daran nachgeführt werden (siehe split).
+    :param labels: ein schon gerastertes Label-Array im Format von self.labels (z.B. aus einem Snapshot). Dann wird nicht
+                   neu gerastert."""
+    def __init__(self, plates: PlateSet, size: tuple[int, int], labels: np.ndarray | None = None):
+        self.plates = plates
+        self.size = size
+        self.cells = np.zeros(size, dtype=np.intp)
+        # rows[Nummer] ist der Index der Platte in der Plattenliste, -1 für entfernte Platten (und für 0).
+        self.rows = np.full(1, -1, dtype=np.intp)
+        # ids[Index] ist die Nummer der Platte
+        self.ids = np.empty(0, dtype=np.intp)
+        self.bboxes = np.empty((0, 4))
+        self.ghosts = GhostLayer(plates, size)
+        if labels is None:
+            self.rebuild()
+        else:
+            self._number()
+            self.cells[:] = np.asarray(labels) + 1
+            self.bboxes = self.plates.bboxes()
+
+    @property
+    def labels(self) -> np.ndarray:
+        """Der Index der Platte jeder Zelle, -1 für Zellen, die in keiner Platte vollständig liegen. Form wie size."""
+        return self.rows[self.cells]
+
+    def rebuild(self) -> None:
+        """Baut den ganzen Index neu auf."""
+        self.cells[:] = 0
+        self._number()
+        self.ghosts.rebuild()
+        self.bboxes = self.plates.bboxes()
+        for i, plate in enumerate(self.plates):
+            self._rasterize(i, plate)
+
+    def _number(self) -> None:
+        # nummeriert die Platten neu, in der Reihenfolge der Liste
+        self.ids = np.arange(1, len(self.plates)+1, dtype=np.intp)
+        self.rows = np.arange(-1, len(self.plates), dtype=np.intp)
+
+    def split(self, old_index: int) -> None:
+        """Führt den Index nach World.split nach. Es wird angenommen, dass die Platte mit dem Index :param old_index aus der
+        Liste entfernt wurde und die zwei neuen Platten am Ende der Liste angehängt wurden.
+        Neu gerastert werden nur die Zellen der alten Platte."""
+        x0, y0, x1, y1 = self._cell_range(self.bboxes[old_index])
+        region = self.cells[x0:x1, y0:y1]
+        region[region == self.ids[old_index]] = 0
+
+        self.rows[self.ids[old_index]] = -1
+        self.rows[self.ids[old_index+1:]] -= 1
+        first = len(self.rows)
+        self.rows = np.append(self.rows, [len(self.plates)-2, len(self.plates)-1])
+        self.ids = np.append(np.delete(self.ids, old_index), [first, first+1])
+
+        self.bboxes = np.concatenate([np.delete(self.bboxes, old_index, axis=0),
+                                      [self._bbox(plate) for plate in self.plates[-2:]]])
+        # die neuen Platten liegen in der alten, also sind alle ihre Zellen frei geworden.
+        for i in (len(self.plates)-2, len(self.plates)-1):
+            self._rasterize(i, self.plates[i])
+        self.ghosts.split(old_index)
+
+    def update(self, rows: np.ndarray) -> None:
+        """Führt den Index nach, nachdem sich die Eckpunkte der Platten mit den Indizes :param rows verändert haben
+        (siehe World.step). Neu gerastert werden nur die Bounding-Boxen dieser Platten."""
+        for i in rows:
+            x0, y0, x1, y1 = self._cell_range(self.bboxes[i])
+            region = self.cells[x0:x1, y0:y1]
+            region[region == self.ids[i]] = 0
+        self.bboxes[rows] = self.plates.bboxes()[rows]
+        # erst jetzt, da eine Platte Zellen bekommen kann, die vorher einer anderen veränderten Platte gehörten.
+        for i in rows:
+            self._rasterize(i, self.plates[i])
+        self.ghosts.update(rows)
+
+    def lookup(self, points: np.ndarray) -> np.ndarray:
+        """Gibt für jeden Punkt den Index der Platte zurück, die ihn enthält. Liegt ein Punkt auf einer Grenze, wird wie bei
+        World.getPlate die erste passende Platte in der Liste genommen. Punkte, die in keiner Platte liegen, erhalten -1.
+        :param points: die Punkte, Form (n, 2)."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        out = np.full(len(points), -1, dtype=np.intp)
+
+        cells = np.floor(points).astype(np.intp)
+        in_raster = ((cells >= 0) & (cells < self.size)).all(axis=1)
+        out[in_raster] = self.rows[self.cells[cells[in_raster, 0], cells[in_raster, 1]]]
+
+        # die restlichen Punkte liegen nahe an einer Grenze und werden exakt bestimmt.
+        open_points = np.flatnonzero(out == -1)
+        if len(open_points):
+            out[open_points] = self._exact_lookup(points[open_points])
+        return out
+
+    def _exact_lookup(self, points: np.ndarray, chunk_size: int = 4096) -> np.ndarray:
+        out = np.full(len(points), -1, dtype=np.intp)
+        eps = 1e-9
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start+chunk_size]
+            candidates = ((self.bboxes[None, :, 0] - eps <= chunk[:, None, 0]) & (chunk[:, None, 0] <= self.bboxes[None, :, 2] + eps) &
+                          (self.bboxes[None, :, 1] - eps <= chunk[:, None, 1]) & (chunk[:, None, 1] <= self.bboxes[None, :, 3] + eps))
+            result = out[start:start+chunk_size]
+            for i in np.flatnonzero(candidates.any(axis=0)):
+                selection = np.flatnonzero(candidates[:, i] & (result == -1))
+                if len(selection):
+                    inside = assets.points_in_convex_polygon(chunk[selection], self.plates[i].vertex_array)
+                    result[selection[inside]] = i
+
+            # Punkte ausserhalb der Welt liegen in keiner Platte, aber in der Geisterkopie einer Platte.
+            missing = np.flatnonzero(result == -1)
+            if len(missing) and len(self.ghosts):
+                bboxes = self.ghosts.bboxes
+                candidates = ((bboxes[None, :, 0] - eps <= chunk[missing, None, 0]) & (chunk[missing, None, 0] <= bboxes[None, :, 2] + eps) &
+                              (bboxes[None, :, 1] - eps <= chunk[missing, None, 1]) & (chunk[missing, None, 1] <= bboxes[None, :, 3] + eps))
+                for g in np.flatnonzero(candidates.any(axis=0)):
+                    selection = missing[candidates[:, g] & (result[missing] == -1)]
+                    if len(selection):
+                        inside = assets.points_in_convex_polygon(chunk[selection], self.ghosts.vertices[g])
+                        result[selection[inside]] = self.ghosts.plate_ids[g]
+        return out
+
+    def _rasterize(self, index: int, plate: Plate) -> None:
+        """Setzt alle freien Zellen, die vollständig in der Platte liegen, auf die Platte :param index."""
+        x0, y0, x1, y1 = self._cell_range(self.bboxes[index])
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        # da die Platten konvex sind, liegt eine Zelle in der Platte, wenn alle ihre 4 Ecken (strikt) in der Platte liegen.
+        corners = assets.grid_in_convex_polygon(np.arange(x0, x1+1), np.arange(y0, y1+1), plate.vertex_array, strict=True)
+        inside = corners[:-1, :-1] & corners[1:, :-1] & corners[:-1, 1:] & corners[1:, 1:]
+        region = self.cells[x0:x1, y0:y1]
+        region[inside & (region == 0)] = self.ids[index]
+
+    def _cell_range(self, bbox: np.ndarray) -> tuple[int, int, int, int]:
+        # die Zellen, welche die Bounding-Box überdeckt, begrenzt auf das Raster
+        x0, y0, x1, y1 = bbox
+        return (max(int(np.floor(x0)), 0), max(int(np.floor(y0)), 0),
+                min(int(np.ceil(x1)), self.size[0]), min(int(np.ceil(y1)), self.size[1]))
+
+    @staticmethod
+    def _bbox(plate: Plate) -> np.ndarray:
+        vertices = plate.vertex_array
+        return np.concatenate([vertices.min(axis=0), vertices.max(axis=0)])
@@ -1,11 +1,13 @@
 """Alles zu den Klassen Plate und World"""
 from __future__ import annotations
 import numpy as np
-from typing import Literal, Iterable
-from shapely.geometry import Polygon, Point
-from assets import getPointOnLinesegment
+from typing import Literal, Iterable, Iterator, TYPE_CHECKING, overload
+from assets import EdgeTable, points_in_convex_polygon
 from math import pi
 
+if TYPE_CHECKING:
+    from topology import Adjacency
+
 
 def create_rays(amount: int) -> tuple[np.ndarray]:
     """Gibt ein tuple zurück mit n Vektoren, die einen Punkt umkreisen.
@@ -19,45 +21,288 @@ def create_rays(amount: int) -> tuple[np.ndarray]:
     return tuple(out)
 
 
+class PlateSet:
+    """Speichert viele Platten in wenigen Arrays statt in je eigenen Objekten: alle Eckpunkte liegen hintereinander in
+    coords, die Eckpunkte der i-ten Platte sind coords[offsets[i]:offsets[i+1]]. Plattenpunkte, Driftvektoren und Typen
+    liegen in points, drifts und types.
+    Von aussen verhält sich ein PlateSet wie eine Liste von Platten (Index, del, append, extend, Iteration, len). Die
+    Platten sind nur Ansichten auf eine Zeile des PlateSets und behalten ihre Identität, auch wenn sich ihre Zeile ändert.
+    Eine Platte gehört immer zu genau einem PlateSet. Wird sie aus einem PlateSet entfernt, bekommt sie ein eigenes."""
+    __slots__ = ("coords", "offsets", "points", "drifts", "types", "_plates", "_private")
+
+    def __init__(self, plates: Iterable[Plate] = ()):
+        self.coords = np.empty((0, 2))
+        self.offsets = np.zeros(1, dtype=np.intp)
+        self.points = np.empty((0, 2))
+        self.drifts = np.empty((0, 2))
+        self.types = np.empty(0, dtype="<U1")
+        self._plates: list[Plate] = []
+        # ein privates PlateSet gehört zu einer einzelnen Platte, die (noch) in keinem anderen PlateSet ist.
+        self._private = False
+        self.extend(plates)
+
+    @classmethod
+    def from_arrays(cls, coords: np.ndarray, offsets: np.ndarray, points: np.ndarray, drifts: np.ndarray,
+                    types: np.ndarray) -> PlateSet:
+        """Erstellt ein PlateSet direkt aus den Arrays (z.B. aus einem Snapshot, siehe snapshot.py), ohne die Platten
+        einzeln zu erstellen. Die Arrays werden kopiert."""
+        plates = cls()
+        plates.coords = np.array(coords, dtype=float).reshape(-1, 2)
+        plates.offsets = np.array(offsets, dtype=np.intp)
+        plates.points = np.array(points, dtype=float).reshape(-1, 2)
+        plates.drifts = np.array(drifts, dtype=float).reshape(-1, 2)
+        plates.types = np.array(types, dtype="<U1")
+        if not (len(plates.offsets) - 1 == len(plates.points) == len(plates.drifts) == len(plates.types)) \
+                or plates.offsets[0] != 0 or plates.offsets[-1] != len(plates.coords):
+            raise ValueError("Die Arrays passen nicht zusammen")
+        for row in range(len(plates.points)):
+            plate = Plate.__new__(Plate)
+            plate._set = plates
+            plate._row = row
+            plate._edges = None
+            plates._plates.append(plate)
+        return plates
+
+    def __len__(self) -> int:
+        return len(self._plates)
+
+    def __iter__(self) -> Iterator[Plate]:
+        return iter(self._plates)
+
+    def __repr__(self):
+        return f"PlateSet({self._plates})"
+
+    @overload
+    def __getitem__(self, index: int) -> Plate: ...
+    @overload
+    def __getitem__(self, index: slice) -> list[Plate]: ...
+
+    def __getitem__(self, index):
+        return self._plates[index]
+
+    def __delitem__(self, index: int) -> None:
+        index = range(len(self))[index]
+        plate = self._plates[index]
+        # die entfernte Platte bekommt eine Kopie ihrer Daten, damit sie weiterhin verwendet werden kann.
+        PlateSet._single(plate, self.vertices(index).copy(), self.points[index].copy(), self.drifts[index].copy(),
+                         self.types[index])
+
+        start, end = self.offsets[index], self.offsets[index+1]
+        self.coords = np.delete(self.coords, np.s_[start:end], axis=0)
+        self.offsets = np.delete(self.offsets, index+1)
+        self.offsets[index+1:] -= end - start
+        self.points = np.delete(self.points, index, axis=0)
+        self.drifts = np.delete(self.drifts, index, axis=0)
+        self.types = np.delete(self.types, index)
+        del self._plates[index]
+        for plate in self._plates[index:]:
+            plate._row -= 1
+
+    def index(self, plate: Plate) -> int:
+        """Gibt den Index von :param plate zurück (ohne die Liste zu durchsuchen)."""
+        if plate._set is not self:
+            raise ValueError(f"{plate!r} is not in PlateSet")
+        return plate._row
+
+    def append(self, plate: Plate) -> None:
+        self.extend([plate])
+
+    def extend(self, plates: Iterable[Plate], copy: bool = False) -> None:
+        """Hängt die Platten an. Sie dürfen zu keinem anderen PlateSet gehören, ausser zu ihrem eigenen.
+        :param copy: falls True, wird statt einer Platte, die schon zu einem anderen PlateSet gehört, eine Kopie von ihr
+                     angehängt (siehe Plate.copy)."""
+        plates = list(plates)
+        if not plates:
+            return
+        if copy:
+            plates = [plate if plate._set._private else plate.copy() for plate in plates]
+        for plate in plates:
+            if not plate._set._private:
+                raise ValueError(f"{plate!r} already belongs to another PlateSet")
+        sets = [plate._set for plate in plates]
+        self._append(plates, [s.coords for s in sets], np.concatenate([s.points for s in sets]),
+                     np.concatenate([s.drifts for s in sets]), np.concatenate([s.types for s in sets]))
+
+    def _append(self, plates: list[Plate], vertices: list[np.ndarray], points: np.ndarray, drifts: np.ndarray, types: np.ndarray) -> None:
+        lengths = np.array([len(v) for v in vertices], dtype=np.intp)
+        self.coords = np.concatenate([self.coords, *vertices]).astype(float, copy=False)
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+        self.points = np.concatenate([self.points, np.asarray(points, dtype=float).reshape(-1, 2)])
+        self.drifts = np.concatenate([self.drifts, np.asarray(drifts, dtype=float).reshape(-1, 2)])
+        self.types = np.concatenate([self.types, types])
+        for plate in plates:
+            plate._set = self
+            plate._row = len(self._plates)
+            self._plates.append(plate)
+
+    @staticmethod
+    def _single(plate: Plate, vertices: np.ndarray, point: np.ndarray, drift: np.ndarray, PType: str) -> PlateSet:
+        # erstellt ein privates PlateSet, das nur :param plate enthält
+        own = PlateSet.__new__(PlateSet)
+        own.coords = vertices
+        own.offsets = np.array([0, len(vertices)], dtype=np.intp)
+        own.points = point.reshape(1, 2)
+        own.drifts = drift.reshape(1, 2)
+        own.types = np.array([PType], dtype="<U1")
+        own._plates = [plate]
+        own._private = True
+        plate._set = own
+        plate._row = 0
+        return own
+
+    def copy(self) -> PlateSet:
+        """Gibt ein neues PlateSet mit Kopien aller Platten zurück."""
+        return PlateSet.from_arrays(self.coords, self.offsets, self.points, self.drifts, self.types)
+
+    def vertices(self, index: int) -> np.ndarray:
+        """Gibt die Eckpunkte der Platte :param index als Array der Form (e, 2) zurück (eine Ansicht auf coords)."""
+        return self.coords[self.offsets[index]:self.offsets[index+1]]
+
+    def set_vertices(self, index: int, vertices: np.ndarray) -> None:
+        """Ersetzt die Eckpunkte der Platte :param index. Die Anzahl der Eckpunkte darf sich ändern."""
+        vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+        self._plates[index]._edges = None
+        start, end = self.offsets[index], self.offsets[index+1]
+        if len(vertices) == end - start:
+            self.coords[start:end] = vertices
+            return
+        self.coords = np.concatenate([self.coords[:start], vertices, self.coords[end:]])
+        self.offsets[index+1:] += len(vertices) - (end - start)
+
+    def update_vertices(self, vertices: dict[int, np.ndarray]) -> None:
+        """Ersetzt die Eckpunkte mehrerer Platten auf einmal. Im Gegensatz zu mehreren Aufrufen von set_vertices wird coords
+        dabei höchstens einmal neu angelegt.
+        :param vertices: die neuen Eckpunkte pro Index"""
+        vertices = {index: np.asarray(v, dtype=float).reshape(-1, 2) for index, v in vertices.items()}
+        for index in vertices:
+            self._plates[index]._edges = None
+        lengths = np.diff(self.offsets)
+        new_lengths = lengths.copy()
+        for index, v in vertices.items():
+            new_lengths[index] = len(v)
+        if np.array_equal(lengths, new_lengths):
+            for index, v in vertices.items():
+                self.coords[self.offsets[index]:self.offsets[index+1]] = v
+            return
+        self.coords = np.concatenate([vertices[i] if i in vertices else self.vertices(i) for i in range(len(self))] +
+                                     [np.empty((0, 2))])
+        self.offsets = np.concatenate([[0], np.cumsum(new_lengths)]).astype(np.intp)
+
+    def bboxes(self) -> np.ndarray:
+        """Gibt die Bounding-Boxen aller Platten als Array der Form (n, 4) mit (x0, y0, x1, y1) zurück."""
+        if not len(self):
+            return np.empty((0, 4))
+        starts = self.offsets[:-1]
+        return np.concatenate([np.minimum.reduceat(self.coords, starts), np.maximum.reduceat(self.coords, starts)], axis=1)
+
+    def centroids(self) -> np.ndarray:
+        """Gibt die Schwerpunkte aller Platten zurück, Form (n, 2)."""
+        if not len(self):
+            return np.empty((0, 2))
+        starts = self.offsets[:-1]
+        # der Nachfolger jedes Eckpunktes innerhalb seiner Platte
+        following = np.arange(len(self.coords)) + 1
+        following[self.offsets[1:] - 1] = starts
+        x0, y0 = self.coords[:, 0], self.coords[:, 1]
+        x1, y1 = self.coords[following, 0], self.coords[following, 1]
+        cross = x0*y1 - x1*y0
+        area = np.add.reduceat(cross, starts) / 2
+        cx = np.add.reduceat((x0 + x1)*cross, starts) / (6*area)
+        cy = np.add.reduceat((y0 + y1)*cross, starts) / (6*area)
+        return np.stack([cx, cy], axis=1)
+
+
 class Plate:
-    """Ist definiert als eine liste an vertices, einem PlatePoint, sowie einem drift-vektor"""
+    """Ist definiert als eine liste an vertices, einem PlatePoint, sowie einem drift-vektor.
+    Die Daten liegen in einem PlateSet (siehe dort), die Platte selbst merkt sich nur, in welchem und in welcher Zeile,
+    sowie ihre Kantentabelle (siehe edges)."""
+    __slots__ = ("_set", "_row", "_edges")
+
     def __init__(self, point: np.ndarray[int | float, int | float], vertices: Iterable[tuple[int | float, int | float]],
                  PType: Literal["K", "O"], drift: np.array = np.array((0, 0))):
-
-        self.vertices = tuple(tuple(i) for i in vertices)  # gibt man direkt np.arrays ins tuple, dann funktioniert tuple.index nicht mehr
-        self.Plate_point = point
-        self.drift_vector = drift
         if not type(PType) is str or not PType.upper() in ["K", "O"]:
             raise TypeError("PType ist entweder 'K' oder 'O'")
-        else:
-            self.PType = PType
+        self._edges = None
+        PlateSet._single(self, np.array([tuple(i) for i in vertices], dtype=float).reshape(-1, 2),
+                         np.array(point, dtype=float), np.array(drift, dtype=float), PType)
+
+    @property
+    def vertices(self) -> tuple[tuple[float, float], ...]:
+        # als tuple, da tuple.index mit np.arrays nicht funktioniert
+        return tuple(map(tuple, self._set.vertices(self._row).tolist()))
+
+    @vertices.setter
+    def vertices(self, vertices: Iterable[tuple[int | float, int | float]]) -> None:
+        self._set.set_vertices(self._row, [tuple(i) for i in vertices])
+
+    @property
+    def vertex_array(self) -> np.ndarray:
+        """Die Eckpunkte als (schreibgeschütztes) Array der Form (e, 2), ohne Kopie."""
+        vertices = self._set.vertices(self._row)
+        vertices.flags.writeable = False
+        return vertices
+
+    @property
+    def edges(self) -> EdgeTable:
+        """Die Kanten der Platte als EdgeTable. Sie wird beim ersten Zugriff berechnet und bleibt gespeichert, bis sich die
+        Eckpunkte ändern (siehe PlateSet.set_vertices und PlateSet.update_vertices)."""
+        if self._edges is None:
+            self._edges = EdgeTable(self._set.vertices(self._row))
+        return self._edges
+
+    @property
+    def Plate_point(self) -> np.ndarray:
+        return self._set.points[self._row]
+
+    @Plate_point.setter
+    def Plate_point(self, point: np.ndarray) -> None:
+        self._set.points[self._row] = point
+
+    @property
+    def drift_vector(self) -> np.ndarray:
+        return self._set.drifts[self._row]
+
+    @drift_vector.setter
+    def drift_vector(self, drift: np.ndarray) -> None:
+        self._set.drifts[self._row] = drift
+
+    @property
+    def PType(self) -> str:
+        return str(self._set.types[self._row])
 
     def __repr__(self):
         return str(self.vertices)
 
-    def split(self, point: np.ndarray[int | float, int | float], t: float) -> tuple[Plate, Plate]:
+    def copy(self) -> Plate:
+        """Gibt eine neue Platte mit denselben Daten zurück, die zu keinem PlateSet gehört."""
+        return Plate(self.Plate_point, self.vertex_array, self.PType, self.drift_vector)
+
+    def split(self, point: np.ndarray[int | float, int | float], t: float, adjacency: Adjacency | None = None) -> tuple[Plate, Plate]:
         """Trennt die Platte entlang einer Mittelsenkrechte zwischen dem Plattenpunkt und dem gegebenen punkt point.
         Platte bleibt intakt, gibt 2 Platten zurück
         :param point: siehe oben
-        :param t: gibt an, wann die Platte gebrochen ist."""
-        if not (Polygon(self.vertices).contains(Point(point)) or Polygon(self.vertices).touches(Point(point))):
+        :param t: gibt an, wann die Platte gebrochen ist.
+        :param adjacency: falls angegeben, werden darin die Nachbarschaften der neuen Platten nachgeführt."""
+        vertices = self.vertices
+        edges = self.edges
+        if not edges.contains(point):
             raise ValueError("Point is located outside the Plate.")
-        P = self.Plate_point
+        P = self.Plate_point.copy()
         R = point
         midpoint = R + (P-R)*0.5
         vector: np.ndarray[int | float, int | float] = P-R
         # das rotiert den Vektor um 90°
         vector[0], vector[1] = -vector[1], vector[0]
 
-        # loopt über alle Paare von Punkten → Ecken, und sucht, welche Ecken die Mittelsenkrechte schneidet.
+        # schneidet die Mittelsenkrechte mit allen Kanten auf einmal und sucht, welche Kanten sie schneidet. Die Kanten
+        # werden ab der Kante vertices[-1] → vertices[0] durchgegangen.
+        Q, hit = edges.intersect_line(midpoint, vector)
+        order = np.roll(np.arange(len(vertices)), 1)
         Border_to_Poly = dict()
-        for i in range(len(self.vertices)):
-            E1 = self.vertices[i-1]
-            E2 = self.vertices[i]
-            Q = getPointOnLinesegment(midpoint, vector, np.array(E1), np.array(E2))
-            if len(Border_to_Poly) < 2 and Q is not None:
+        for i in order[hit[order]]:
+            if len(Border_to_Poly) < 2:
                 # np.arrays sind mutable -> nicht hashable -> kann man nicht als key gebrauchen
-                Border_to_Poly[tuple(Q)] = (E1, E2)
+                Border_to_Poly[tuple(Q[i])] = (vertices[i], vertices[(i+1) % len(vertices)])
 
         # Die Platten werden wieder zusammengesetzt
         Border = tuple(Border_to_Poly.keys())
@@ -68,11 +313,11 @@ class Plate:
 
         walker = Border_to_Poly[tuple(start_P)][0]
         # um herauszufinden, wie genau der walker die Liste absuchen soll, muss er zuerst wissen, wo auf der Liste er sich befindet
-        index = self.vertices.index(tuple(walker))
+        index = vertices.index(tuple(walker))
 
         other_p = np.array(Border_to_Poly[tuple(start_P)][1])
-        other_p_index = self.vertices.index(tuple(other_p))
-        if (index-other_p_index) % len(self.vertices) == 1:
+        other_p_index = vertices.index(tuple(other_p))
+        if (index-other_p_index) % len(vertices) == 1:
             direction = 1
         else:
             direction = -1
@@ -103,14 +348,14 @@ class Plate:
 
             # der Walker geht ein Schritt weiter. Falls er am Ende der Liste angelangt ist, kann er einfach hinten wieder anfangen.
             index += direction
-            walker = self.vertices[index % len(self.vertices)]
+            walker = vertices[index % len(vertices)]
 
         # die Platten werden fertiggestellt. Dazu werden auch den jeweiligen Driftvektor und den Plattenpunkt zugeteilt
         out = []
         for plate_vertices in Plates:
             # Die Zuteilung des Plattenpunktes ist relativ einfach, da sich der Plattenpunkt
             # ja innerhalb der Platte befinden muss.
-            if Polygon(plate_vertices).contains(Point(P)) or Polygon(plate_vertices).touches(Point(P)):
+            if points_in_convex_polygon(P[None], np.array(plate_vertices, dtype=float))[0]:
                 plate_point = P
             else:
                 plate_point = R
@@ -121,4 +366,7 @@ class Plate:
 
             out.append(Plate(point=plate_point, vertices=plate_vertices, PType=self.PType, drift=drift_vector+self.drift_vector))
 
+        if adjacency is not None:
+            adjacency.split(self, out, R)
+
         return tuple((out[0], out[1]))
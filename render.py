@@ -0,0 +1,245 @@
+"""Rendern der Welt in Kacheln, auch parallel auf mehreren Prozessen oder direkt in eine Datei."""
+from __future__ import annotations
+
+import numpy as np
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Callable, Iterator, TYPE_CHECKING
+from instrumentation import RenderStats, Progress, NO_STATS
+
+if TYPE_CHECKING:
+    from world import World
+
+
+def iter_tiles(size: tuple[int, int], tile_size: int) -> Iterator[tuple[int, int, int, int]]:
+    """Teilt eine Welt der Grösse :param size in Kacheln auf und gibt sie zeilenweise als (x0, y0, x1, y1) zurück.
+    Die Kacheln am Rand können kleiner als :param tile_size sein."""
+    if tile_size < 1:
+        raise ValueError("tile_size muss mindestens 1 sein")
+    for y0 in range(0, size[1], tile_size):
+        for x0 in range(0, size[0], tile_size):
+            yield x0, y0, min(x0+tile_size, size[0]), min(y0+tile_size, size[1])
+
+
+# Zustand der Worker-Prozesse. Wird einmal pro Prozess von _init_worker gesetzt, damit die Welt nicht für jede Kachel
+# neu gepickelt werden muss.
+_worker_world: World | None = None
+_worker_output: np.ndarray | None = None
+_worker_memory: shared_memory.SharedMemory | None = None
+
+
+def _init_worker(world: World, memory_name: str, shape: tuple[int, int]) -> None:
+    global _worker_world, _worker_output, _worker_memory
+    _worker_world = world
+    _worker_memory = shared_memory.SharedMemory(name=memory_name)
+    _worker_output = np.ndarray(shape, dtype=float, buffer=_worker_memory.buf)
+
+
+def _render_tile_worker(tile: tuple[int, int, int, int], res: int, engine: str, measure: bool) -> tuple[tuple[int, int, int, int], dict]:
+    x0, y0, x1, y1 = tile
+    stats = RenderStats(enabled=measure)
+    _worker_output[y0:y1, x0:x1] = _worker_world.render_tile(tile, res, engine, stats)
+    return tile, stats.as_dict()
+
+
+def render_parallel(world: World, res: int, engine: str, workers: int | None = None, tile_size: int = 64,
+                    progress: Callable[[int, int], None] | None = None, stats: RenderStats = NO_STATS) -> np.ndarray:
+    """Rendert die Welt in Kacheln auf mehreren Prozessen. Die Worker erhalten die Welt einmal beim Start und schreiben
+    ihre Kacheln direkt in ein gemeinsames Array (shared memory). Das Resultat ist identisch mit dem seriellen Rendern.
+    :param world: die Welt
+    :param res: siehe World.render_world
+    :param engine: siehe World.render_world
+    :param workers: Anzahl Prozesse. None verwendet alle CPUs.
+    :param tile_size: Seitenlänge der Kacheln in Pixeln
+    :param progress: siehe World.render_world
+    :param stats: siehe World.render_world. Die Zeiten aller Prozesse werden zusammengezählt."""
+    shape = (world.size[1], world.size[0])
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError("workers muss mindestens 1 sein")
+    tiles = list(iter_tiles(world.size, tile_size))
+
+    memory = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(float).itemsize, 1))
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(world, memory.name, shape)) as pool:
+            reporter = Progress(progress, world.size[0] * world.size[1])
+            # .result() wirft die Fehler der Worker weiter
+            for future in as_completed([pool.submit(_render_tile_worker, tile, res, engine, stats.enabled) for tile in tiles]):
+                (x0, y0, x1, y1), tile_stats = future.result()
+                stats.merge(tile_stats)
+                reporter.update((x1-x0) * (y1-y0))
+        A = np.ndarray(shape, dtype=float, buffer=memory.buf).copy()
+    finally:
+        memory.close()
+        memory.unlink()
+    return A
+
+
+def iter_render(world: World, res: int = 6, engine: str = "scalar", tile_size: int = 64,
+                skip: set[tuple[int, int, int, int]] | None = None,
+                stats: RenderStats = NO_STATS) -> Iterator[tuple[tuple[int, int, int, int], np.ndarray]]:
+    """Rendert die Welt Kachel für Kachel und gibt jede fertige Kachel als (tile, heights) zurück, wobei tile = (x0, y0, x1, y1)
+    und heights die Form (y1-y0, x1-x0) hat. So kann man schon mit Teilen der Karte arbeiten, bevor alles gerendert ist.
+    :param skip: Kacheln, die nicht gerendert werden sollen (z.B. weil sie schon fertig sind).
+    :param stats: siehe World.render_world"""
+    for tile in iter_tiles(world.size, tile_size):
+        if skip and tile in skip:
+            continue
+        yield tile, world.render_tile(tile, res, engine, stats)
+
+
+def stream_to_file(world: World, path: str | os.PathLike, res: int = 6, engine: str = "scalar",
+                   tile_size: int = 64, stats: RenderStats = NO_STATS) -> Iterator[tuple[tuple[int, int, int, int], np.ndarray]]:
+    """Rendert die Welt Kachel für Kachel direkt in eine memory-mapped .npy-Datei, sodass die ganze Karte nie im Speicher
+    sein muss. Gibt wie iter_render jede fertige Kachel zurück, nachdem sie auf die Festplatte geschrieben wurde.
+    Welche Kacheln schon fertig sind, wird in einer zweiten Datei (path + ".tiles.npy") festgehalten. Existieren beide
+    Dateien schon, wird dort weitergemacht, wo das letzte Mal aufgehört wurde.
+    Die Einstellungen des Renders werden in path + ".json" gespeichert. Passen sie nicht zum bestehenden Render, gibt es einen ValueError.
+    Dort steht auch ein Fingerabdruck der Platten (siehe _fingerprint). Hat sich die Welt seither verändert (z.B. durch
+    split oder step), wird der bestehende Render verworfen und von vorne begonnen.
+    :param path: die .npy-Datei, in welche die Höhen geschrieben werden
+    :param stats: siehe World.render_world"""
+    path = os.fspath(path)
+    shape = (world.size[1], world.size[0])
+    tiles_shape = (-(-shape[0] // tile_size), -(-shape[1] // tile_size))
+    settings = {"size": list(world.size), "res": res, "engine": engine, "tile_size": tile_size}
+    fingerprint = _fingerprint(world)
+
+    resume = False
+    if os.path.exists(path) and os.path.exists(path + ".tiles.npy") and os.path.exists(path + ".json"):
+        with open(path + ".json") as f:
+            stored = json.load(f)
+        if {key: value for key, value in stored.items() if key != "world"} != settings:
+            raise ValueError(f"{path} was rendered with different settings")
+        resume = stored.get("world") == fingerprint
+
+    if resume:
+        A = np.lib.format.open_memmap(path, mode="r+")
+        done = np.lib.format.open_memmap(path + ".tiles.npy", mode="r+")
+    else:
+        A = np.lib.format.open_memmap(path, mode="w+", dtype=float, shape=shape)
+        done = np.lib.format.open_memmap(path + ".tiles.npy", mode="w+", dtype=bool, shape=tiles_shape)
+        with open(path + ".json", "w") as f:
+            json.dump({**settings, "world": fingerprint}, f)
+
+    finished = {tile for tile in iter_tiles(world.size, tile_size) if done[tile[1] // tile_size, tile[0] // tile_size]}
+    try:
+        for tile, heights in iter_render(world, res, engine, tile_size, skip=finished, stats=stats):
+            x0, y0, x1, y1 = tile
+            A[y0:y1, x0:x1] = heights
+            # zuerst müssen die Höhen auf der Festplatte sein, erst dann wird die Kachel als fertig markiert.
+            A.flush()
+            done[y0 // tile_size, x0 // tile_size] = True
+            done.flush()
+            yield tile, heights
+    finally:
+        del A, done
+
+
+def _fingerprint(world: World) -> str:
+    # Hash über alle Daten der Platten, die in die Höhen eingehen
+    plates = world.plates
+    digest = hashlib.sha1()
+    for array in (np.array(world.size), plates.coords, plates.offsets, plates.points, plates.drifts, plates.types):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def render_adaptive(world: World, res: int = 6, tolerance: float = 0.01, base_step: int = 8, engine: str = "vector",
+                    stats: RenderStats = NO_STATS) -> np.ndarray:
+    """Rendert die Welt zuerst auf einem groben Gitter und verfeinert nur Zellen, deren Ecken sich um mehr als :param tolerance
+    unterscheiden, in verschiedenen Platten liegen oder deren Mitte um mehr als :param tolerance vom interpolierten Wert
+    abweicht. Die Höhen in allen anderen Zellen werden bilinear interpoliert.
+    Da die Platten konvex sind, liegt eine Zelle, deren 4 Ecken in derselben Platte liegen, ganz in dieser Platte.
+    :param res: siehe World.render_world
+    :param tolerance: maximaler Unterschied der Eckhöhen und der Mitte, bei dem eine Zelle noch interpoliert wird. Das ist
+                      keine Fehlerschranke: Details, die weder eine Ecke noch die Mitte einer Zelle treffen, werden
+                      übersehen. Mit 0 werden nur Zellen interpoliert, deren Ecken und Mitte genau passen.
+    :param base_step: Abstand der Punkte des groben Gitters in Pixeln
+    :param engine: siehe World.render_world
+    :param stats: siehe World.render_world. Zusätzlich werden die Zähler "samples" (berechnete Punkte) und "interpolated"
+                  (interpolierte Punkte) hochgezählt."""
+    if base_step < 1:
+        raise ValueError("base_step muss mindestens 1 sein")
+    width, height = world.size
+    A = np.full((height, width), np.nan)
+    labels = np.full((height, width), -1, dtype=np.intp)
+
+    def sample(xs: np.ndarray, ys: np.ndarray) -> None:
+        # berechnet alle noch unbekannten Punkte
+        points = np.unique(np.stack([xs.ravel(), ys.ravel()], axis=1), axis=0)
+        points = points[np.isnan(A[points[:, 1], points[:, 0]])]
+        if len(points):
+            A[points[:, 1], points[:, 0]] = world._heights(points, res, engine, stats)
+            labels[points[:, 1], points[:, 0]] = world.getPlates(points)
+            stats.count("samples", len(points))
+
+    # grobes Gitter. Die letzte Zeile und Spalte werden immer mitgenommen, auch wenn sie nicht auf dem Gitter liegen.
+    grid_x = np.unique(np.append(np.arange(0, width, base_step), width-1))
+    grid_y = np.unique(np.append(np.arange(0, height, base_step), height-1))
+    sample(*np.meshgrid(grid_x, grid_y))
+    x0, y0 = np.meshgrid(grid_x[:-1], grid_y[:-1]) if len(grid_x) > 1 and len(grid_y) > 1 else (np.empty(0, int), np.empty(0, int))
+    x1, y1 = np.meshgrid(grid_x[1:], grid_y[1:]) if len(grid_x) > 1 and len(grid_y) > 1 else (np.empty(0, int), np.empty(0, int))
+    cells = np.stack([x0.ravel(), y0.ravel(), x1.ravel(), y1.ravel()], axis=1).astype(np.intp)
+
+    while len(cells):
+        x0, y0, x1, y1 = cells.T
+        corners = [(y0, x0), (y0, x1), (y1, x0), (y1, x1)]
+        heights = np.stack([A[c] for c in corners])
+        plates = np.stack([labels[c] for c in corners])
+        refine = (heights.max(axis=0) - heights.min(axis=0) > tolerance) | (plates.min(axis=0) != plates.max(axis=0))
+        # Zellen ohne Punkte im Inneren sind schon fertig
+        splittable = (x1 - x0 > 1) | (y1 - y0 > 1)
+
+        # gleiche Ecken heissen nicht, dass das Innere flach ist (z.B. ein schmaler Grat mitten in der Zelle). Deshalb
+        # wird auch die Mitte berechnet und mit dem interpolierten Wert verglichen. Sie wird beim Verfeinern ohnehin gebraucht.
+        check = np.flatnonzero(~refine & splittable)
+        cx0, cy0, cx1, cy1 = cells[check].T
+        mx, my = (cx0 + cx1) // 2, (cy0 + cy1) // 2
+        sample(mx, my)
+        fx, fy = (mx - cx0) / (cx1 - cx0), (my - cy0) / (cy1 - cy0)
+        predicted = (A[cy0, cx0] * (1-fx) * (1-fy) + A[cy0, cx1] * fx * (1-fy) +
+                     A[cy1, cx0] * (1-fx) * fy + A[cy1, cx1] * fx * fy)
+        refine[check] = np.abs(A[my, mx] - predicted) > tolerance
+
+        _interpolate(A, cells[~refine & splittable], stats)
+
+        cells = cells[refine & splittable]
+        x0, y0, x1, y1 = cells.T
+        mx = np.where(x1 - x0 > 1, (x0 + x1) // 2, x0)
+        my = np.where(y1 - y0 > 1, (y0 + y1) // 2, y0)
+        sample(np.concatenate([mx, mx, mx, x0, x1]), np.concatenate([y0, y1, my, my, my]))
+
+        children = np.concatenate([np.stack([x0, y0, mx, my], axis=1), np.stack([mx, y0, x1, my], axis=1),
+                                   np.stack([x0, my, mx, y1], axis=1), np.stack([mx, my, x1, y1], axis=1)])
+        # Zellen mit Breite oder Höhe 0 entstehen, wenn nur in einer Richtung geteilt wurde.
+        cells = children[(children[:, 2] > children[:, 0]) & (children[:, 3] > children[:, 1])]
+
+    # bei Welten, die nur 1 Pixel breit oder hoch sind, gibt es keine Zellen
+    missing = np.isnan(A)
+    if missing.any():
+        ys, xs = np.nonzero(missing)
+        sample(xs, ys)
+    return A
+
+
+def _interpolate(A: np.ndarray, cells: np.ndarray, stats: RenderStats) -> None:
+    # füllt die unbekannten Punkte der Zellen bilinear aus den Ecken. Zellen derselben Grösse werden zusammen berechnet.
+    sizes = cells[:, 2:] - cells[:, :2]
+    for w, h in np.unique(sizes, axis=0):
+        group = cells[(sizes[:, 0] == w) & (sizes[:, 1] == h)]
+        dy, dx = np.mgrid[0:h+1, 0:w+1]
+        xs = group[:, 0, None, None] + dx
+        ys = group[:, 1, None, None] + dy
+        fx, fy = dx / w, dy / h
+        x0, y0, x1, y1 = (group[:, i, None, None] for i in range(4))
+        values = (A[y0, x0] * (1-fx) * (1-fy) + A[y0, x1] * fx * (1-fy) +
+                  A[y1, x0] * (1-fx) * fy + A[y1, x1] * fx * fy)
+        unknown = np.isnan(A[ys, xs])
+        stats.count("interpolated", np.unique(ys[unknown] * A.shape[1] + xs[unknown]).size)
+        A[ys[unknown], xs[unknown]] = values[unknown]
@@ -0,0 +1,124 @@
+"""Speichern und Laden von Welten und gerenderten Höhenkarten in einem kompakten Binärformat.
+
+Ein Snapshot ist ein Ordner:
+    world.npz           die Platten als flache Arrays (siehe plates.PlateSet), age, time, der Zustand des Zufallsgenerators,
+                        der gerasterte PlateIndex, die Nachbarschaften und die Grenzgeraden (siehe boundaries.py). Damit
+                        muss beim Laden nichts neu berechnet werden.
+    heightmaps/<name>.npy
+                        gerenderte Höhenkarten. Sie werden erst beim Zugriff und memory-mapped geladen (siehe load_heightmap)."""
+from __future__ import annotations
+
+import numpy as np
+import os
+from typing import Mapping, TYPE_CHECKING
+from plates import PlateSet
+from plateindex import PlateIndex
+from topology import Adjacency
+from boundaries import BoundaryLines
+
+if TYPE_CHECKING:
+    from world import World
+
+# wird erhöht, wenn sich das Format ändert. Ältere Snapshots können dann nicht mehr geladen werden.
+SNAPSHOT_VERSION = 2
+WORLD_FILE = "world.npz"
+HEIGHTMAP_DIR = "heightmaps"
+
+
+def save_world(world: World, path: str | os.PathLike, heightmaps: Mapping[str, np.ndarray] | None = None) -> None:
+    """Speichert die Welt als Snapshot im Ordner :param path. Ein bestehender Snapshot wird überschrieben.
+    :param heightmaps: Höhenkarten, die zusammen mit der Welt gespeichert werden (siehe save_heightmap)."""
+    path = os.fspath(path)
+    os.makedirs(path, exist_ok=True)
+    plates = world.plates
+    version, state, gauss = world.random.getstate()
+
+    # die Nachbarschaften als eine Zeile pro Abschnitt: (Platte, Kante, u0, u1, Nachbar, dx, dy)
+    rows, segments = [], []
+    for i, plate in enumerate(plates):
+        for edge, edge_segments in enumerate(world.adjacency.edges[plate]):
+            for u0, u1, neighbour, offset in edge_segments:
+                rows.append((i, edge, plates.index(neighbour)))
+                segments.append((u0, u1, *offset))
+
+    arrays = {
+        "version": np.array(SNAPSHOT_VERSION),
+        "size": np.array(world.size, dtype=np.int64),
+        "coords": plates.coords,
+        "offsets": plates.offsets.astype(np.int64),
+        "points": plates.points,
+        "drifts": plates.drifts,
+        "types": plates.types,
+        "age": np.array(world.age, dtype=float),
+        "time": np.array(world.time, dtype=float),
+        "rng_version": np.array(version),
+        "rng_state": np.array(state, dtype=np.int64),
+        "rng_gauss": np.array(np.nan if gauss is None else gauss),
+        "labels": world.index.labels.astype(np.int32),
+        "adjacency_rows": np.array(rows, dtype=np.int64).reshape(-1, 3),
+        "adjacency_segments": np.array(segments, dtype=float).reshape(-1, 4),
+        "dirty": np.array(sorted(plates.index(plate) for plate in world.dirty_plates), dtype=np.int64),
+        **{"boundary_" + name: array for name, array in world.boundaries.as_arrays(plates).items()},
+    }
+    # zuerst in eine temporäre Datei schreiben, damit ein abgebrochenes Speichern keinen halben Snapshot hinterlässt.
+    tmp = os.path.join(path, WORLD_FILE + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, os.path.join(path, WORLD_FILE))
+
+    for name, heights in (heightmaps or {}).items():
+        save_heightmap(path, name, heights)
+
+
+def load_world(path: str | os.PathLike) -> World:
+    """Lädt eine mit save_world gespeicherte Welt. Index und Nachbarschaften werden nicht neu berechnet."""
+    from world import World
+
+    with np.load(os.path.join(os.fspath(path), WORLD_FILE)) as data:
+        if int(data["version"]) != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} has snapshot version {int(data['version'])}, expected {SNAPSHOT_VERSION}")
+        size = tuple(int(i) for i in data["size"])
+        plates = PlateSet.from_arrays(data["coords"], data["offsets"], data["points"], data["drifts"], data["types"])
+
+        edges = {plate: [[] for _ in range(plates.offsets[i+1] - plates.offsets[i])] for i, plate in enumerate(plates)}
+        for (i, edge, neighbour), (u0, u1, dx, dy) in zip(data["adjacency_rows"].tolist(), data["adjacency_segments"].tolist()):
+            edges[plates[i]][edge].append((u0, u1, plates[neighbour], (dx, dy)))
+
+        boundaries = BoundaryLines.from_arrays(plates, size, *(data["boundary_" + name] for name in
+                                                               ("normals", "offsets", "speeds", "pointers", "lines", "signs")))
+
+        world = World(size, plates, index=PlateIndex(plates, size, labels=data["labels"]),
+                      adjacency=Adjacency(plates, size, edges=edges), boundaries=boundaries)
+        world.age = float(data["age"])
+        world.time = float(data["time"])
+        gauss = float(data["rng_gauss"])
+        world.random.setstate((int(data["rng_version"]), tuple(data["rng_state"].tolist()), None if np.isnan(gauss) else gauss))
+        world.dirty_plates.update(plates[i] for i in data["dirty"].tolist())
+    return world
+
+
+def _heightmap_path(path: str | os.PathLike, name: str) -> str:
+    if not name or "." in name or "/" in name or "\\" in name:
+        raise ValueError(f"invalid heightmap name {name!r}")
+    return os.path.join(os.fspath(path), HEIGHTMAP_DIR, name + ".npy")
+
+
+def save_heightmap(path: str | os.PathLike, name: str, heights: np.ndarray) -> None:
+    """Speichert eine Höhenkarte unter dem Namen :param name im Snapshot :param path."""
+    file = _heightmap_path(path, name)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    np.save(file, np.asarray(heights, dtype=float))
+
+
+def load_heightmap(path: str | os.PathLike, name: str) -> np.ndarray:
+    """Öffnet die Höhenkarte :param name des Snapshots :param path memory-mapped und schreibgeschützt. Sie wird also erst
+    von der Festplatte gelesen, wenn auf die Pixel zugegriffen wird."""
+    return np.load(_heightmap_path(path, name), mmap_mode="r")
+
+
+def heightmap_names(path: str | os.PathLike) -> list[str]:
+    """Gibt die Namen aller Höhenkarten im Snapshot :param path zurück."""
+    directory = os.path.join(os.fspath(path), HEIGHTMAP_DIR)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(file[:-4] for file in os.listdir(directory) if file.endswith(".npy") and "." not in file[:-4])
@@ -0,0 +1,295 @@
+"""Nachbarschaften der Platten: welche Platte liegt auf der anderen Seite einer Kante?"""
+from __future__ import annotations
+
+import numpy as np
+from typing import Iterable, Sequence
+from plates import Plate, PlateSet
+
+# ein Abschnitt einer Kante: (u0, u1, Nachbarplatte, Verschiebung). u0 und u1 sind die Parameter entlang der Kante
+# (0 = vertices[i], 1 = vertices[i+1]). Ein Punkt x auf diesem Abschnitt liegt bei x + Verschiebung auf dem Rand der
+# Nachbarplatte. Die Verschiebung ist nur am Rand der Welt nicht (0, 0), da die Welt dort auf der anderen Seite weitergeht.
+Segment = tuple[float, float, Plate, tuple[float, float]]
+
+
+class Adjacency:
+    """Hält für jede Kante jeder Platte fest, welche Platten auf der anderen Seite liegen. Eine Kante kann an mehrere
+    Platten grenzen, da beim Teilen einer Platte die Kanten der Nachbarplatten nicht unterteilt werden.
+    Nach World.split muss split aufgerufen werden (das macht Plate.split, wenn man ihm die Adjacency mitgibt).
+    :param edges: schon bestimmte Nachbarschaften im Format von self.edges (z.B. aus einem Snapshot). Dann wird nicht
+                  neu verglichen."""
+    def __init__(self, plates: Iterable[Plate], size: tuple[int, int], tol: float = 1e-7,
+                 edges: dict[Plate, list[list[Segment]]] | None = None):
+        self.size = size
+        self.tol = tol
+        self.edges: dict[Plate, list[list[Segment]]] = {}
+        self._flat: dict[Plate, tuple[np.ndarray, np.ndarray, np.ndarray, list[Plate], np.ndarray]] = {}
+        if edges is None:
+            self.build(plates)
+        else:
+            self.edges = edges
+
+    def build(self, plates: Iterable[Plate]) -> None:
+        """Bestimmt alle Nachbarschaften neu, indem jede Kante mit allen anderen Kanten verglichen wird."""
+        plates = list(plates)
+        self.edges = {plate: [[] for _ in plate.vertex_array] for plate in plates}
+        self._flat.clear()
+        owners, starts, ends = [], [], []
+        for plate in plates:
+            vertices = plate.vertex_array
+            owners.extend((plate, i) for i in range(len(vertices)))
+            starts.append(vertices)
+            ends.append(np.roll(vertices, -1, axis=0))
+        if not owners:
+            return
+        starts, ends = np.concatenate(starts), np.concatenate(ends)
+
+        for k, (plate, i) in enumerate(owners):
+            d = ends[k] - starts[k]
+            length = np.linalg.norm(d)
+            if length <= self.tol:
+                continue
+            for t in self._offsets():
+                # Kanten, die (verschoben um t) auf derselben Geraden liegen wie Kante k
+                a, b = starts + t - starts[k], ends + t - starts[k]
+                collinear = (np.abs(d[0]*a[:, 1] - d[1]*a[:, 0]) <= self.tol*length) & (np.abs(d[0]*b[:, 1] - d[1]*b[:, 0]) <= self.tol*length)
+                if not any(t):
+                    collinear[k] = False
+                ua, ub = a @ d / length**2, b @ d / length**2
+                lo, hi = np.maximum(np.minimum(ua, ub), 0), np.minimum(np.maximum(ua, ub), 1)
+                for j in np.flatnonzero(collinear & (hi - lo > self.tol)):
+                    self.edges[plate][i].append((lo[j], hi[j], owners[j][0], (-t[0], -t[1])))
+            self.edges[plate][i].sort(key=lambda segment: segment[0])
+
+    def update(self, plates: PlateSet, changed: Iterable[Plate]) -> None:
+        """Bestimmt die Nachbarschaften neu, nachdem sich die Eckpunkte der Platten :param changed verändert haben (siehe
+        World.step). Neu bestimmt werden nur die Kanten der veränderten Platten und ihrer alten und neuen Nachbarn, und
+        verglichen wird nur mit Platten, deren Bounding-Box (auch über den Rand der Welt hinweg) die Platte berührt.
+        Das Resultat ist (bis auf Rundungsfehler) dasselbe wie bei build."""
+        changed = list(changed)
+        bboxes = plates.bboxes()
+        following = np.arange(len(plates.coords)) + 1
+        following[plates.offsets[1:] - 1] = plates.offsets[:-1]
+        starts, ends = plates.coords, plates.coords[following]
+        owners = np.repeat(np.arange(len(plates)), np.diff(plates.offsets))
+
+        old_neighbours = {neighbour for plate in changed for neighbour in self.neighbours(plate)}
+        self.edges.update(self._edges_of(plates, changed, bboxes, starts, ends, owners))
+        new_neighbours = {neighbour for plate in changed for neighbour in self.neighbours(plate)}
+        self.edges.update(self._edges_of(plates, (old_neighbours | new_neighbours).difference(changed), bboxes, starts, ends, owners))
+        for plate in old_neighbours | new_neighbours | set(changed):
+            self._flat.pop(plate, None)
+
+    def _edges_of(self, plates: PlateSet, selection: Iterable[Plate], bboxes: np.ndarray, starts: np.ndarray,
+                  ends: np.ndarray, owners: np.ndarray, chunk_size: int = 1024) -> dict[Plate, list[list[Segment]]]:
+        # wie build, aber nur für die Kanten der Platten :param selection und für alle diese Kanten auf einmal. Verglichen
+        # wird nur mit Kanten von Platten, deren Bounding-Box die Bounding-Box der Platte berührt.
+        selection = list(selection)
+        edges = {plate: [[] for _ in plate.vertex_array] for plate in selection}
+        if not selection:
+            return edges
+        rows = np.array([plates.index(plate) for plate in selection], dtype=np.intp)
+        counts = np.diff(plates.offsets)
+        found = []
+        # in Blöcken, damit die Matrix der Bounding-Box-Vergleiche nicht zu gross wird
+        for start in range(0, len(rows), chunk_size):
+            block = rows[start:start+chunk_size]
+            lo_box, hi_box = bboxes[block, :2] - self.tol, bboxes[block, 2:] + self.tol
+            for t in self._offsets():
+                near = ((bboxes[None, :, 0] + t[0] <= hi_box[:, None, 0]) & (bboxes[None, :, 2] + t[0] >= lo_box[:, None, 0]) &
+                        (bboxes[None, :, 1] + t[1] <= hi_box[:, None, 1]) & (bboxes[None, :, 3] + t[1] >= lo_box[:, None, 1]))
+                pr, pj = np.nonzero(near)
+                if not len(pr):
+                    continue
+                # alle Paare (eigene Kante k, andere Kante j) der Plattenpaare, j aufsteigend wie in build
+                own_count, other_count = counts[block[pr]], counts[pj]
+                sizes = own_count * other_count
+                pair = np.repeat(np.arange(len(pr)), sizes)
+                local = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+                k = plates.offsets[block[pr]][pair] + local // other_count[pair]
+                j = plates.offsets[pj][pair] + local % other_count[pair]
+
+                d = ends[k] - starts[k]
+                length = np.linalg.norm(d, axis=1)
+                a, b = starts[j] + t - starts[k], ends[j] + t - starts[k]
+                collinear = ((np.abs(d[:, 0]*a[:, 1] - d[:, 1]*a[:, 0]) <= self.tol*length) &
+                             (np.abs(d[:, 0]*b[:, 1] - d[:, 1]*b[:, 0]) <= self.tol*length) & (length > self.tol))
+                if not any(t):
+                    collinear &= j != k
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    ua = (d[:, 0]*a[:, 0] + d[:, 1]*a[:, 1]) / length**2
+                    ub = (d[:, 0]*b[:, 0] + d[:, 1]*b[:, 1]) / length**2
+                lo, hi = np.maximum(np.minimum(ua, ub), 0), np.minimum(np.maximum(ua, ub), 1)
+                hit = np.flatnonzero(collinear & (hi - lo > self.tol))
+                found.append((start + pr[pair[hit]], k[hit], lo[hit], hi[hit], j[hit], t))
+
+        for pr, k, lo, hi, j, t in found:
+            for p, edge, u0, u1, other in zip(pr.tolist(), k.tolist(), lo, hi, j.tolist()):
+                plate = selection[p]
+                edges[plate][edge - plates.offsets[rows[p]]].append((u0, u1, plates[owners[other]], (-t[0], -t[1])))
+        for plate_edges in edges.values():
+            for segments in plate_edges:
+                segments.sort(key=lambda segment: segment[0])
+        return edges
+
+    def _offsets(self) -> list[tuple[float, float]]:
+        return [(dx, dy) for dx in (0, -self.size[0], self.size[0]) for dy in (0, -self.size[1], self.size[1])]
+
+    def neighbours(self, plate: Plate) -> list[Plate]:
+        """Gibt alle Platten zurück, die eine Kante mit :param plate teilen (auch über den Rand der Welt hinweg)."""
+        out = {}
+        for segments in self.edges[plate]:
+            for segment in segments:
+                if segment[2] is not plate:
+                    out[segment[2]] = None
+        return list(out)
+
+    def edge_index(self, plate: Plate, E1: Sequence[float], E2: Sequence[float]) -> int | None:
+        """Gibt den Index der Kante von :param E1 nach :param E2 in plate.vertices zurück."""
+        vertices = plate.vertex_array
+        match = np.flatnonzero((vertices == E1).all(axis=1) & (np.roll(vertices, -1, axis=0) == E2).all(axis=1))
+        return int(match[0]) if len(match) else None
+
+    def neighbour(self, plate: Plate, edge: int, point: np.ndarray) -> Plate | None:
+        """Gibt die Platte zurück, die auf der anderen Seite der Kante :param edge an der Stelle :param point liegt.
+        Ist das nicht bekannt, wird None zurückgegeben."""
+        segment = self.segment(plate, edge, point)
+        return segment[2] if segment is not None else None
+
+    def segment(self, plate: Plate, edge: int, point: np.ndarray) -> Segment | None:
+        """Wie neighbour, gibt aber den ganzen Abschnitt (mit der Verschiebung) zurück."""
+        vertices = plate.vertex_array
+        E1 = vertices[edge]
+        d = vertices[(edge+1) % len(vertices)] - E1
+        u = (np.asarray(point) - E1) @ d / (d @ d)
+        for segment in self.edges[plate][edge]:
+            if segment[0] - self.tol <= u <= segment[1] + self.tol:
+                return segment
+        return None
+
+    def neighbour_array(self, plate: Plate, edges: np.ndarray, points: np.ndarray, plate_ids: dict[Plate, int],
+                        return_offsets: bool = False) -> np.ndarray | tuple[np.ndarray, np.ndarray]:
+        """Array-Version von neighbour.
+        :param edges: die Indices der getroffenen Kanten
+        :param points: die Punkte auf diesen Kanten, mit einer Achse mehr als :param edges
+        :param plate_ids: ordnet jeder Platte ihren Index in World.plates zu
+        :param return_offsets: falls True, werden zusätzlich die Verschiebungen der Abschnitte zurückgegeben (siehe Segment)
+        :returns: die Indices der Nachbarplatten, -1 falls unbekannt"""
+        if plate not in self._flat:
+            self._flat[plate] = self._flatten(plate)
+        pointers, u0, u1, neighbours, segment_offsets = self._flat[plate]
+        neighbour_ids = np.array([plate_ids.get(neighbour, -1) for neighbour in neighbours] + [-1], dtype=np.intp)
+
+        vertices = plate.vertex_array
+        E1 = vertices[edges]
+        d = vertices[(edges+1) % len(vertices)] - E1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u = np.einsum("...k,...k->...", points - E1, d) / np.einsum("...k,...k->...", d, d)
+
+        out = np.full(edges.shape, -1, dtype=np.intp)
+        offsets = np.zeros(edges.shape + (2,))
+        count = pointers[edges+1] - pointers[edges]
+        # jede Kante hat nur wenige Abschnitte, also werden einfach alle nacheinander durchprobiert.
+        for s in range(int(count.max(initial=0))):
+            candidate = np.minimum(pointers[edges] + s, len(u0) - 1)
+            match = (out == -1) & (s < count) & (u0[candidate] - self.tol <= u) & (u <= u1[candidate] + self.tol)
+            out[match] = neighbour_ids[candidate[match]]
+            offsets[match] = segment_offsets[candidate[match]]
+        if return_offsets:
+            return out, offsets
+        return out
+
+    def _flatten(self, plate: Plate) -> tuple[np.ndarray, np.ndarray, np.ndarray, list[Plate], np.ndarray]:
+        segments = self.edges[plate]
+        pointers = np.cumsum([0] + [len(edge) for edge in segments])
+        flat = [segment for edge in segments for segment in edge]
+        return (pointers, np.array([s[0] for s in flat], dtype=float), np.array([s[1] for s in flat], dtype=float),
+                [s[2] for s in flat], np.array([s[3] for s in flat], dtype=float).reshape(-1, 2))
+
+    def split(self, old: Plate, new_plates: Sequence[Plate], point: np.ndarray) -> None:
+        """Führt die Nachbarschaften nach dem Teilen der Platte :param old nach. Es werden nur die Kanten der alten Platte und
+        die Kanten der Nachbarplatten, die an die alte Platte grenzen, angeschaut.
+        :param new_plates: die zwei Platten, die Plate.split zurückgegeben hat
+        :param point: der Punkt, an dem die Platte geteilt wurde"""
+        P = np.asarray(old.Plate_point, dtype=float)
+        R = np.asarray(point, dtype=float)
+        midpoint = R + (P-R)*0.5
+        normal = P - R
+        scale = np.linalg.norm(normal)
+        # die Platte, die den Plattenpunkt P enthält, liegt auf der positiven Seite der Mittelsenkrechte.
+        if (np.asarray(new_plates[0].Plate_point) - midpoint) @ normal > 0:
+            positive, negative = new_plates
+        else:
+            negative, positive = new_plates
+
+        def resolve(start: np.ndarray, end: np.ndarray, u0: float, u1: float, offset: tuple[float, float]) -> list[Segment]:
+            # teilt einen Abschnitt, der an die alte Platte grenzt, auf die zwei neuen Platten auf.
+            sa = (start + offset - midpoint) @ normal
+            sb = (end + offset - midpoint) @ normal
+            if (sa > self.tol*scale and sb < -self.tol*scale) or (sa < -self.tol*scale and sb > self.tol*scale):
+                s = u0 + (u1-u0) * sa/(sa-sb)
+                return [(u0, s, positive if sa > 0 else negative, offset), (s, u1, positive if sb > 0 else negative, offset)]
+            return [(u0, u1, positive if sa + sb > 0 else negative, offset)]
+
+        old_vertices = old.vertex_array
+        old_starts, old_ends = old_vertices, np.roll(old_vertices, -1, axis=0)
+        for child in new_plates:
+            other = negative if child is positive else positive
+            vertices = child.vertex_array
+            child_edges = []
+            for p, q in zip(vertices, np.roll(vertices, -1, axis=0)):
+                if np.linalg.norm(q-p) <= self.tol:
+                    child_edges.append([])
+                    continue
+                if abs((p - midpoint) @ normal) <= self.tol*scale and abs((q - midpoint) @ normal) <= self.tol*scale:
+                    # die neue Grenze zwischen den beiden Platten
+                    child_edges.append([(0., 1., other, (0., 0.))])
+                    continue
+
+                # die Kante ist ein Teil einer Kante der alten Platte
+                i = self._containing_edge(old_starts, old_ends, p, q)
+                d = old_ends[i] - old_starts[i]
+                tp, tq = (p - old_starts[i]) @ d / (d @ d), (q - old_starts[i]) @ d / (d @ d)
+                segments = []
+                for a, b, neighbour, offset in self.edges[old][i]:
+                    lo, hi = max(a, min(tp, tq)), min(b, max(tp, tq))
+                    if hi - lo <= self.tol:
+                        continue
+                    u0, u1 = sorted(((lo - tp)/(tq - tp), (hi - tp)/(tq - tp)))
+                    if neighbour is old:
+                        segments.extend(resolve(p + u0*(q-p), p + u1*(q-p), u0, u1, offset))
+                    else:
+                        segments.append((u0, u1, neighbour, offset))
+                segments.sort(key=lambda segment: segment[0])
+                child_edges.append(segments)
+            self.edges[child] = child_edges
+
+        for neighbour in self.neighbours(old):
+            vertices = neighbour.vertex_array
+            for i, segments in enumerate(self.edges[neighbour]):
+                if not any(segment[2] is old for segment in segments):
+                    continue
+                start, end = vertices[i], vertices[(i+1) % len(vertices)]
+                new_segments = []
+                for u0, u1, plate, offset in segments:
+                    if plate is old:
+                        new_segments.extend(resolve(start + u0*(end-start), start + u1*(end-start), u0, u1, offset))
+                    else:
+                        new_segments.append((u0, u1, plate, offset))
+                self.edges[neighbour][i] = new_segments
+            self._flat.pop(neighbour, None)
+
+        del self.edges[old]
+        self._flat.pop(old, None)
+
+    def _containing_edge(self, starts: np.ndarray, ends: np.ndarray, p: np.ndarray, q: np.ndarray) -> int:
+        # gibt die Kante zurück, auf welcher die Punkte p und q beide liegen.
+        d = ends - starts
+        lengths = np.linalg.norm(d, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distance = np.maximum(np.abs(d[:, 0]*(p-starts)[:, 1] - d[:, 1]*(p-starts)[:, 0]),
+                                  np.abs(d[:, 0]*(q-starts)[:, 1] - d[:, 1]*(q-starts)[:, 0])) / lengths
+            tp = np.einsum("ek,ek->e", p - starts, d) / lengths**2
+            tq = np.einsum("ek,ek->e", q - starts, d) / lengths**2
+        outside = (np.minimum(tp, tq) < -self.tol) | (np.maximum(tp, tq) > 1 + self.tol)
+        distance[(lengths <= self.tol) | outside] = np.inf
+        return int(np.argmin(distance))
@@ -2,91 +2,660 @@
 from __future__ import annotations
 
 import numpy as np
-from typing import Iterable
-from shapely.geometry import Polygon, Point
+from typing import Iterable, Iterator, Literal, Callable
 import random as rand
 import assets
 import heightfunc
-from plates import Plate, create_rays
-import sys
+from plates import Plate, PlateSet, create_rays
+from plateindex import PlateIndex
+from topology import Adjacency
+from boundaries import BoundaryLines
+from instrumentation import RenderStats, Progress, NO_STATS
+import render
+import snapshot
+
+# wie oft ein Strahl höchstens über den Rand der Welt zurück in die eigene Platte laufen kann (eine Platte kann z.B. die
+# ganze Breite der Welt einnehmen). Ein Strahl, der danach noch immer in der eigenen Platte ist, trifft nie auf eine echte
+# Grenze (z.B. parallel zu einer Grenze, die einmal um die ganze Welt geht) und wird für die Höhe nicht gezählt, ausser
+# das gilt für alle Strahlen eines Punktes. Die Engines markieren solche Strahlen als "endless".
+MAX_WRAPS = 100
+
+# die Engines für render_world
+Engine = Literal["scalar", "vector", "distance", "adaptive"]
+ENGINES = ("scalar", "vector", "distance", "adaptive")
+
+# mit engine="adaptive" bekommt ein Punkt höchstens so viele Male mehr Strahlen als res (siehe getPointHeightsAdaptive)
+ADAPTIVE_REFINEMENT = 16
 
 
 class World:
     """Der Container für die Platten"""
-    def __init__(self, size: tuple[int, int], plates: Iterable[Plate] | None = None):
+    def __init__(self, size: tuple[int, int], plates: Iterable[Plate] | None = None, seed: int | None = None,
+                 index: PlateIndex | None = None, adjacency: Adjacency | None = None, boundaries: BoundaryLines | None = None):
+        """:param size: Grösse der Welt
+        :param plates: die Platten. Ohne Platten besteht die Welt aus einer einzigen Platte. Platten, die schon zu einer
+                       anderen Welt gehören, werden kopiert.
+        :param seed: Seed für den Zufallsgenerator der Welt. Mit demselben Seed ergeben dieselben Aufrufe von split
+                     dieselbe Welt.
+        :param index: / :param adjacency: / :param boundaries: schon aufgebaute Strukturen für :param plates (z.B. aus
+                     einem Snapshot, siehe World.load). Sonst werden sie neu aufgebaut."""
         self.size = size
-        if plates:
-            self.plates = list(plates)
+        if isinstance(plates, PlateSet) and (index is not None or adjacency is not None or boundaries is not None):
+            # die schon aufgebauten Strukturen gehören zu genau diesem PlateSet (siehe snapshot.load_world)
+            self.plates = plates
+        elif isinstance(plates, PlateSet):
+            # sonst wird kopiert, damit split die Welt, zu der die Platten gehören, nicht mitverändert.
+            self.plates = plates.copy()
+        elif plates:
+            self.plates = PlateSet()
+            self.plates.extend(plates, copy=True)
         else:
-            self.plates = [Plate(point=np.array((size[0]/2, size[1]/2)),
-                                 vertices=((0, 0), (0, size[1]), (size[0], size[1]), (size[0], 0)),
-                                 PType="K")]
+            self.plates = PlateSet([Plate(point=np.array((size[0]/2, size[1]/2)),
+                                          vertices=((0, 0), (0, size[1]), (size[0], size[1]), (size[0], 0)),
+                                          PType="K")])
 
         self.age = 1
+        # jede Welt hat ihren eigenen Zufallsgenerator, damit sie unabhängig vom globalen Zustand reproduzierbar ist.
+        self.random = rand.Random(seed)
+        # ordnet Punkte ihrer Platte zu. Muss bei jeder Änderung an self.plates nachgeführt werden.
+        self.index = index if index is not None else PlateIndex(self.plates, self.size)
+        # hält fest, welche Platte auf der anderen Seite jeder Kante liegt. Wird von Plate.split nachgeführt.
+        self.adjacency = adjacency if adjacency is not None else Adjacency(self.plates, self.size)
+        # die Geraden, aus denen die Platten bestehen, und wie sie driften (siehe step). Wird in split nachgeführt.
+        self.boundaries = boundaries if boundaries is not None else BoundaryLines(self.plates, self.size)
+        # wie lange die Platten schon driften
+        self.time = 0.
+        # Interaktionen der Platten pro Kante. Einträge von entfernten Platten werden in split gelöscht.
+        self.interactions = heightfunc.InteractionTable()
+        # Platten, deren Pixel sich seit dem letzten Rendern verändert haben könnten (siehe update_render).
+        self.dirty_plates: set[Plate] = set()
 
     def getPlate(self, point: np.ndarray[int, int]) -> Plate:
         """gibt an, in welcher Platte der angegebene Punkt enthalten ist."""
-        selected_plate = None
-        # es werden alle plates durchgeloopt bis die Platte gefunden ist, in der der Punkt enthalten ist.
-        for plate in self.plates:
-            # ".contains" doesn't include points on boundary, but ".touches" returns True for points on the boundary
-            if Polygon(plate.vertices).contains(Point(point)) or Polygon(plate.vertices).touches(Point(point)):
-                selected_plate = plate
-                return selected_plate
+        return self.plates[self.getPlates(point)[0]]
+
+    def getPlates(self, points: np.ndarray) -> np.ndarray:
+        """Batch-Version von getPlate: gibt für jeden Punkt den Index (in self.plates) der Platte zurück, die ihn enthält.
+        Liegt ein Punkt auf einer Grenze, wird wie bei getPlate die erste passende Platte genommen.
+        :param points: die Punkte, Form (n, 2)."""
+        out = self.index.lookup(points)
 
         # es kann theoretisch möglich sein, dass der Punkt in keiner Plate enthalten ist
-        if not selected_plate:
+        if (out == -1).any():
             raise TypeError("Point is not contained in any Plate")
+        return out
 
     def split(self, point: np.ndarray[int | float, int | float] | None = None) -> None:
         """finds the plate that contains :param point, then splits that plate along the perpendicular bisector of the Plate_point and :param point."""
         if point is None:
-            point = np.array((rand.uniform(0, self.size[0]), rand.uniform(0, self.size[1])))
+            point = np.array((self.random.uniform(0, self.size[0]), self.random.uniform(0, self.size[1])))
             # wurde kein Punkt spezifiziert, generiert das Programm einen zufälligen Punkt
 
-        selected_plate = self.getPlate(point)
+        self._split_plate(self.getPlates(point)[0], point)
+        self.age -= self.random.uniform(0, self.age/2)
+
+    def generate(self, n_splits: int, seed: int | None = None, progress: Callable[[int, int], None] | None = None,
+                 stats: RenderStats | None = None) -> None:
+        """Teilt die Welt :param n_splits Mal an zufälligen Punkten. Das Resultat ist dasselbe wie bei n_splits Aufrufen
+        von split() mit demselben Zufallsgenerator, aber alle Zufallszahlen werden im Voraus gezogen und die Platten aller
+        Punkte auf einmal im Index nachgeschaut. Nach jeder Teilung werden nur die Punkte neu zugeordnet, die in der
+        geteilten Platte lagen.
+        :param seed: falls angegeben, wird der Zufallsgenerator der Welt vorher neu gesetzt.
+        :param progress: wird wie bei render_world mit (erledigte Teilungen, n_splits) aufgerufen.
+        :param stats: falls angegeben, wird darin die Zeit der Schritte "draw", "plate_lookup" und "split" gemessen und
+                      die Teilungen werden im Zähler "splits" gezählt. Die Teilungen pro Sekunde sind also
+                      counters["splits"] / sum(timers.values())."""
+        stats = stats if stats is not None else NO_STATS
+        if seed is not None:
+            self.random.seed(seed)
+        reporter = Progress(progress, n_splits)
+        with stats.stage("draw"):
+            # dieselben Zahlen in derselben Reihenfolge wie in split: x, y und die Änderung von age.
+            # random.uniform(a, b) ist a + (b-a) * random(), daher gibt das genau dieselben Punkte.
+            draws = np.array([self.random.random() for _ in range(3*n_splits)]).reshape(n_splits, 3)
+            points = draws[:, :2] * np.array(self.size, dtype=float)
+        with stats.stage("plate_lookup"):
+            homes = self.getPlates(points) if n_splits else np.empty(0, dtype=np.intp)
+
+        for k in range(n_splits):
+            selected_index = homes[k]
+            with stats.stage("split"):
+                self._split_plate(selected_index, points[k])
+            self.age -= (self.age/2) * float(draws[k, 2])
+
+            with stats.stage("plate_lookup"):
+                # die Platten nach der geteilten rücken eine Stelle nach vorne, die Punkte in der geteilten Platte liegen
+                # jetzt in einer der neuen Platten.
+                pending = homes[k+1:]
+                moved = np.flatnonzero(pending == selected_index)
+                pending[pending > selected_index] -= 1
+                if len(moved):
+                    pending[moved] = self.getPlates(points[k+1:][moved])
+            stats.count("splits")
+            reporter.update()
+
+    def _split_plate(self, selected_index: int, point: np.ndarray) -> None:
+        # teilt die Platte mit dem Index :param selected_index an :param point und führt alles nach (ausser age)
+        selected_plate = self.plates[selected_index]
+
+        # die Nachbarn müssen bestimmt werden, solange die alte Platte noch in self.adjacency ist.
+        neighbours = self.getNeighbours(selected_plate)
 
         # die alte Platte wird gesplittet. Dies gibt 2 neue Platten zurück.
-        new_plates = selected_plate.split(point, self.age)
+        new_plates = selected_plate.split(point, self.age, self.adjacency)
+        self.boundaries.split(selected_plate, new_plates, point)
 
         # die alte Platte wird durch die neuen Platten ersetzt
-        self.plates.remove(selected_plate)
+        del self.plates[selected_index]
         self.plates.extend(new_plates)
+        self.index.split(selected_index)
+        self.interactions.invalidate(selected_plate)
+
+        # die Pixel der alten Platte gehören jetzt zu den neuen Platten. Zusätzlich ändern sich die Pixel der Nachbarplatten,
+        # deren Strahlen in die alte Platte hineinreichen.
+        self.dirty_plates.discard(selected_plate)
+        self.dirty_plates.update(new_plates)
+        self.dirty_plates.update(neighbours)
+
+    def step(self, dt: float = 1., stats: RenderStats | None = None) -> list[Plate]:
+        """Lässt die Platten während der Zeit :param dt driften: jede Grenze, die beim Teilen einer Platte entstanden ist,
+        verschiebt sich mit dem Driftvektor der geteilten Platte (siehe boundaries.BoundaryLines). Nachgeführt werden nur
+        die Platten, deren Eckpunkte sich dabei verändern, sowie der Index und die Nachbarschaften um sie herum. Diese
+        Platten und ihre Nachbarn werden für update_render vorgemerkt.
+        Ein Plattenpunkt, der nicht mehr in seiner Platte liegt, wird auf den Schwerpunkt der Platte gesetzt.
+        :param stats: falls angegeben, wird darin die Zeit der Schritte "boundaries", "geometry", "index" und "adjacency"
+                      gemessen und die veränderten Platten im Zähler "changed_plates" gezählt.
+        :returns: die veränderten Platten"""
+        stats = stats if stats is not None else NO_STATS
+        with stats.stage("boundaries"):
+            changed = self.boundaries.advance(self.plates, dt)
+        self.time += dt
+        stats.count("steps")
+        if not changed:
+            return []
+
+        neighbours = {neighbour for plate in changed for neighbour in self.getNeighbours(plate)}
+        with stats.stage("geometry"):
+            rows = np.array(sorted(self.plates.index(plate) for plate in changed), dtype=np.intp)
+            self.plates.update_vertices({self.plates.index(plate): vertices for plate, vertices in changed.items()})
+            centroids = self.plates.centroids()
+            for plate, vertices in changed.items():
+                if not assets.points_in_convex_polygon(plate.Plate_point[None], vertices)[0]:
+                    plate.Plate_point = centroids[self.plates.index(plate)]
+        with stats.stage("index"):
+            self.index.update(rows)
+        with stats.stage("adjacency"):
+            self.adjacency.update(self.plates, changed)
+        neighbours.update(neighbour for plate in changed for neighbour in self.getNeighbours(plate))
+
+        for plate in changed:
+            self.interactions.invalidate(plate)
+        self.dirty_plates.update(changed)
+        self.dirty_plates.update(neighbours)
+        stats.count("changed_plates", len(changed))
+        return list(changed)
 
-        self.age -= rand.uniform(0, self.age/2)
+    def simulate(self, epochs: int, dt: float = 1., res: int = 6, engine: Engine = "vector",
+                 heightmap: np.ndarray | None = None, stats: RenderStats | None = None) -> Iterator[np.ndarray]:
+        """Lässt die Platten :param epochs Mal um :param dt driften und gibt nach jedem Schritt die Höhenkarte zurück.
+        Neu berechnet werden jeweils nur die Pixel, die sich verändert haben könnten (siehe update_render).
+        :param heightmap: die aktuelle Höhenkarte (mit denselben res und engine). Ohne wird sie zuerst gerendert.
+        :param stats: siehe step"""
+        A = heightmap if heightmap is not None else self.render_world(res, engine)
+        for _ in range(epochs):
+            self.step(dt, stats)
+            A = self.update_render(A, res, engine)
+            yield A
 
-    def getPointHeight(self, point: np.ndarray[int | float, int | float], resolution: int) -> float:
+    def getNeighbours(self, plate: Plate) -> list[Plate]:
+        """Gibt alle Platten zurück, die eine Kante mit :param plate teilen, auch über den Rand der Welt hinweg."""
+        return self.adjacency.neighbours(plate)
+
+    def getPointHeight(self, point: np.ndarray[int | float, int | float], resolution: int, stats: RenderStats = NO_STATS) -> float:
         """gibt die Höhe eines Punktes zurück.
         :param point: der besagte Punkt
-        :param resolution: Mit welcher Genauigkeit die Höhe des Punktes berechnet wird. je höher, desto genauer"""
-        homeplate = self.getPlate(point)
+        :param resolution: Mit welcher Genauigkeit die Höhe des Punktes berechnet wird. je höher, desto genauer
+        :param stats: falls angegeben, wird darin die Zeit der einzelnen Schritte gemessen"""
+        with stats.stage("plate_lookup"):
+            homeplate = self.getPlate(point)
         P = point
         values = []
+        stats.count("points")
+        stats.count("rays", resolution)
+        edges = homeplate.edges
+        endless = []
         for ray in create_rays(resolution):
             threshold = 0.001
-            Q, E1, E2 = assets.getborderpointbyvector(P, ray, Polygon(homeplate.vertices), threshold)
-            if Polygon(homeplate.vertices).exterior.distance(Point(Q)) > threshold:
-                print(Q)
-            Q += ((ray/np.linalg.norm(ray)) * threshold)
-            if not (0 <= Q[0] <= self.size[0] and (0 <= Q[1] <= self.size[1])):
-                # falls der Punkt über dem Rand der Platte austritt, "erscheint" er an der anderen Seite wieder.
-                neigh_plate = self.getPlate(np.array([Q[0] % self.size[0], Q[1] % self.size[1]]))
-            else:
-                neigh_plate = self.getPlate(Q)
-
-            distance, weight = heightfunc.get_rayvector_components(P, Q, (E1, E2))
-            values.append((heightfunc.get_height_func(abs(distance)*.1, homeplate, neigh_plate, (E1, E2)), np.pi-weight))
-
-        # np.sum() is faster than sum()
-        return np.sum((i[0])*i[1] for i in values) / np.sum(i[1] for i in values)
-
-    def render_world(self, res: int = 6) -> np.ndarray:
+            direction = ray/np.linalg.norm(ray)
+            with stats.stage("intersection"):
+                Q, E1, E2 = assets.getborderpointbyvector(P, ray, edges, threshold)
+            with stats.stage("neighbour_lookup"):
+                # die Nachbarplatte wird direkt an der getroffenen Kante nachgeschaut.
+                edge = self.adjacency.edge_index(homeplate, E1, E2)
+                segment = self.adjacency.segment(homeplate, edge, Q) if edge is not None else None
+                start = P
+                for _ in range(MAX_WRAPS):
+                    if segment is None or segment[2] is not homeplate:
+                        break
+                    # der Strahl verlässt die Welt und kommt in der eigenen Platte wieder herein, die Grenze ist also keine
+                    # echte Grenze. Der Strahl läuft in der Geisterkopie der Platte weiter; gerechnet wird in der Platte
+                    # selbst, dafür wird der Startpunkt mitverschoben.
+                    stats.count("wrapped_rays")
+                    start = start + np.array(segment[3])
+                    Q, E1, E2 = assets.getborderpointbyvector(Q + segment[3] + direction*threshold, ray, edges, threshold)
+                    edge = self.adjacency.edge_index(homeplate, E1, E2)
+                    segment = self.adjacency.segment(homeplate, edge, Q) if edge is not None else None
+                neigh_plate = segment[2] if segment is not None else None
+                endless.append(neigh_plate is homeplate)
+                Q += direction * threshold
+                if neigh_plate is None:
+                    stats.count("neighbour_fallbacks")
+                    # ausserhalb der Welt wird die Platte über die Geisterplatten gefunden (siehe PlateIndex).
+                    neigh_plate = self.getPlate(Q)
+
+            with stats.stage("height_function"):
+                distance, weight = heightfunc.get_rayvector_components(start, Q, (E1, E2))
+                values.append((heightfunc.get_height_func(abs(distance)*.1, homeplate, neigh_plate, (E1, E2), self.interactions), np.pi-weight))
+
+        with stats.stage("weighted_average"):
+            if not all(endless):
+                values = [value for value, is_endless in zip(values, endless) if not is_endless]
+            # np.sum() is faster than sum()
+            return np.sum((i[0])*i[1] for i in values) / np.sum(i[1] for i in values)
+
+    def _cast_rays(self, home_index: int, P: np.ndarray, rays: np.ndarray, plate_ids: dict[Plate, int], centroid: np.ndarray,
+                   stats: RenderStats = NO_STATS, pairwise: bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # schneidet alle Strahlen :param rays aller Punkte :param P (die alle in der Platte home_index liegen) mit dem Rand
+        # der Platte und wertet die Relieffunktionen aus. Gibt die Höhen, die Gewichte und die Strahlen, die nie auf eine
+        # echte Grenze treffen (siehe MAX_WRAPS), zurück, alle mit der Form (Punkte, Strahlen).
+        # Mit pairwise hat jeder Punkt nur seinen eigenen Strahl (rays hat dann die Form (Punkte, 2)), die Resultate haben
+        # die Form (Punkte, 1).
+        homeplate = self.plates[home_index]
+        vertices = homeplate.vertex_array
+        # die Strahlen in einer Form, die zu (Punkte, Strahlen, 2) broadcastet
+        rays = rays[:, None, :] if pairwise else rays[None, :, :]
+        directions = rays/np.linalg.norm(rays, axis=-1)[..., None]
+        threshold = 0.001
+        with stats.stage("intersection"):
+            Q, edges, _ = assets.getborderpointsbyvectors(P, rays[:, 0] if pairwise else rays[0], vertices, threshold, centroid, pairwise)
+            if pairwise:
+                Q, edges = Q[:, None, :], edges[:, None]
+
+        with stats.stage("neighbour_lookup"):
+            # die Nachbarplatte wird direkt an der getroffenen Kante nachgeschaut.
+            neighbours, offsets = self.adjacency.neighbour_array(homeplate, edges, Q, plate_ids, return_offsets=True)
+            starts = np.repeat(P[:, None, :], edges.shape[1], axis=1)
+            for _ in range(MAX_WRAPS):
+                # Strahlen, die über den Rand der Welt in die eigene Platte zurückkommen, laufen in deren
+                # Geisterkopie weiter (siehe getPointHeight).
+                wrapped = np.nonzero(neighbours == home_index)
+                if not len(wrapped[0]):
+                    break
+                stats.count("wrapped_rays", len(wrapped[0]))
+                starts[wrapped] += offsets[wrapped]
+                direction = np.broadcast_to(directions, Q.shape)[wrapped]
+                Q[wrapped], edges[wrapped], _ = assets.getborderpointsbyvectors(
+                    Q[wrapped] + offsets[wrapped] + direction*threshold, np.broadcast_to(rays, Q.shape)[wrapped], vertices,
+                    threshold, centroid, pairwise=True)
+                neighbours[wrapped], offsets[wrapped] = self.adjacency.neighbour_array(
+                    homeplate, edges[wrapped], Q[wrapped], plate_ids, return_offsets=True)
+            Q += directions * threshold
+
+            unknown = neighbours == -1
+            if unknown.any():
+                stats.count("neighbour_fallbacks", unknown.sum())
+                # ausserhalb der Welt wird die Platte über die Geisterplatten gefunden (siehe PlateIndex).
+                neighbours[unknown] = self.getPlates(Q[unknown])
+
+        with stats.stage("height_function"):
+            E1 = vertices[edges]
+            E2 = vertices[(edges+1) % len(vertices)]
+            distance, weight = heightfunc.get_rayvector_components_array(starts, Q, E1, E2)
+
+            values = self._edge_heights(homeplate, vertices, neighbours, edges, np.abs(distance)*.1)
+        return values, np.pi-weight, neighbours == home_index
+
+    def _plate_ids(self) -> dict[Plate, int]:
+        # der Index jeder Platte in self.plates (für Adjacency.neighbour_array)
+        return {plate: i for i, plate in enumerate(self.plates)}
+
+    def _edge_heights(self, homeplate: Plate, vertices: np.ndarray, neighbours: np.ndarray, edges: np.ndarray,
+                      x: np.ndarray) -> np.ndarray:
+        # wertet die Relieffunktionen an den Stellen :param x aus. Jeder Wert gehört zur Kante edges (Index in vertices, den
+        # Eckpunkten von homeplate) zwischen homeplate und der Platte neighbours (Index in self.plates). Alle Werte mit
+        # derselben Kombination aus Nachbarplatte und Kante teilen sich eine Interaktion. Alle Arrays haben dieselbe Form.
+        keys = neighbours * len(vertices) + edges
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        interactions = []
+        for key in unique_keys:
+            edge = key % len(vertices)
+            interactions.append(self.interactions.get(homeplate, self.plates[key // len(vertices)],
+                                                      (vertices[edge], vertices[(edge+1) % len(vertices)])))
+        T = np.array([interaction.T for interaction in interactions])
+        codes = np.array([interaction.code for interaction in interactions])
+        inverse = inverse.reshape(keys.shape)
+        return heightfunc.get_height_array(x, T[inverse], codes[inverse])
+
+    def getPointHeights(self, points: np.ndarray, resolution: int, chunk_size: int = 4096, stats: RenderStats = NO_STATS) -> np.ndarray:
+        """Vektorisierte Version von getPointHeight: berechnet die Höhe vieler Punkte auf einmal.
+        Alle Strahlen aller Punkte einer Platte werden in einem Durchgang mit den Kanten der Platte geschnitten.
+        Die Resultate stimmen bis auf Rundungsfehler mit getPointHeight überein.
+        :param points: die Punkte, Form (n, 2)
+        :param resolution: siehe getPointHeight
+        :param chunk_size: wie viele Punkte höchstens gleichzeitig verarbeitet werden (begrenzt den Speicherverbrauch)
+        :param stats: siehe getPointHeight"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        heights = np.empty(len(points))
+        rays = np.array(create_rays(resolution))
+        stats.count("points", len(points))
+        stats.count("rays", len(points) * resolution)
+
+        with stats.stage("plate_lookup"):
+            homes = self.getPlates(points)
+            plate_ids = self._plate_ids()
+            centroids = self.plates.centroids()
+        for home_index in np.unique(homes):
+            members = np.flatnonzero(homes == home_index)
+            for start in range(0, len(members), chunk_size):
+                selection = members[start:start+chunk_size]
+                values, weights, endless = self._cast_rays(home_index, points[selection], rays, plate_ids, centroids[home_index], stats)
+                with stats.stage("weighted_average"):
+                    weights[endless & ~endless.all(axis=1, keepdims=True)] = 0
+                    heights[selection] = np.sum(values*weights, axis=1) / np.sum(weights, axis=1)
+
+        return heights
+
+    def getPointHeightsAdaptive(self, points: np.ndarray, max_rays: int = 192, min_rays: int = 12, tolerance: float = 1e-3,
+                                chunk_size: int = 4096, stats: RenderStats = NO_STATS) -> tuple[np.ndarray, np.ndarray]:
+        """Wie getPointHeights, aber jeder Punkt bekommt nur so viele Strahlen, wie er braucht.
+        Begonnen wird mit den Strahlen von create_rays(:param min_rays). Danach wird jeder Winkel zwischen zwei benachbarten
+        Strahlen halbiert (create_rays(2n) enthält alle Strahlen von create_rays(n)), falls sich die Höhen der beiden
+        Strahlen, multipliziert mit dem Anteil des Winkels am ganzen Kreis, um mehr als :param tolerance unterscheiden.
+        Dadurch kommen neue Strahlen nur dort dazu, wo ein Strahl auf eine andere Grenze trifft, z.B. in der Nähe von
+        Ecken, an denen drei Platten zusammenkommen. Jeder Strahl wird im gewichteten Mittel mit dem Winkel gewichtet,
+        für den er steht. Werden alle Winkel halbiert, ist das Resultat also dasselbe wie bei getPointHeights(points, n).
+        Schmale Details zwischen den ersten min_rays Strahlen können übersehen werden.
+        :param points: die Punkte, Form (n, 2)
+        :param max_rays: höchstens so viele Strahlen pro Punkt (verwendet wird das grösste min_rays * 2**k <= max_rays)
+        :param min_rays: mit so vielen Strahlen wird begonnen
+        :param tolerance: siehe oben
+        :param chunk_size: siehe getPointHeights
+        :param stats: siehe getPointHeight. Der Zähler "rays" enthält die Anzahl tatsächlich verwendeter Strahlen.
+        :returns: die Höhen und die Anzahl Strahlen, die für jeden Punkt verwendet wurden"""
+        if not 1 <= min_rays <= max_rays:
+            raise ValueError("min_rays has to be between 1 and max_rays")
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        heights = np.empty(len(points))
+        ray_counts = np.empty(len(points), dtype=np.intp)
+        # alle Strahlen, die verwendet werden können. Der Strahl i von create_rays(min_rays) ist hier der Strahl i*step.
+        n = min_rays * 2**int(np.log2(max_rays // min_rays))
+        rays = np.array(create_rays(n))
+        stats.count("points", len(points))
+
+        with stats.stage("plate_lookup"):
+            homes = self.getPlates(points)
+            plate_ids = self._plate_ids()
+            centroids = self.plates.centroids()
+        for home_index in np.unique(homes):
+            members = np.flatnonzero(homes == home_index)
+            for start in range(0, len(members), chunk_size):
+                selection = members[start:start+chunk_size]
+                P = points[selection]
+                sampled = np.zeros((len(P), n), dtype=bool)
+                values, weights = np.zeros((len(P), n)), np.zeros((len(P), n))
+                endless = np.zeros((len(P), n), dtype=bool)
+
+                step = n // min_rays
+                columns = np.arange(0, n, step)
+                values[:, columns], weights[:, columns], endless[:, columns] = self._cast_rays(
+                    home_index, P, rays[columns], plate_ids, centroids[home_index], stats)
+                sampled[:, columns] = True
+                stats.count("rays", len(P) * len(columns))
+                while step > 1:
+                    # die Winkel zwischen den Strahlen a und b (=a+step), deren Höhen sich zu stark unterscheiden
+                    a = np.arange(0, n, step)
+                    b = (a + step) % n
+                    refine = sampled[:, a] & sampled[:, b] & ((np.abs(values[:, a] - values[:, b]) * step/n > tolerance) |
+                                                               (endless[:, a] != endless[:, b]))
+                    rows, intervals = np.nonzero(refine)
+                    if not len(rows):
+                        break
+                    columns = a[intervals] + step//2
+                    v, w, e = self._cast_rays(home_index, P[rows], rays[columns], plate_ids, centroids[home_index], stats,
+                                              pairwise=True)
+                    values[rows, columns], weights[rows, columns], endless[rows, columns] = v[:, 0], w[:, 0], e[:, 0]
+                    sampled[rows, columns] = True
+                    stats.count("rays", len(rows))
+                    step //= 2
+
+                with stats.stage("weighted_average"):
+                    heights[selection], ray_counts[selection] = self._angular_average(sampled, values, weights, endless)
+
+        return heights, ray_counts
+
+    @staticmethod
+    def _angular_average(sampled: np.ndarray, values: np.ndarray, weights: np.ndarray, endless: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # gewichtetes Mittel der Höhen der verwendeten Strahlen (sampled), wobei jeder Strahl zusätzlich mit dem Winkel
+        # gewichtet wird, für den er steht: dem halben Winkel zum vorherigen plus dem halben Winkel zum nächsten Strahl.
+        n = sampled.shape[1]
+        rows, columns = np.nonzero(sampled)
+        firsts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        lasts = np.r_[firsts[1:] - 1, len(rows) - 1]
+        following, previous = np.roll(columns, -1), np.roll(columns, 1)
+        following[lasts] = columns[firsts] + n
+        previous[firsts] = columns[lasts] - n
+        angle_weights = (following - previous) / 2 * weights[rows, columns]
+        weighted = angle_weights * values[rows, columns]
+        real = ~endless[rows, columns]
+        count = len(sampled)
+        sums = [np.bincount(rows, np.where(real, weighted, 0), count), np.bincount(rows, np.where(real, angle_weights, 0), count),
+                np.bincount(rows, weighted, count), np.bincount(rows, angle_weights, count)]
+        has_real = sums[1] > 0
+        heights = np.where(has_real, sums[0] / np.where(has_real, sums[1], 1), sums[2] / sums[3])
+        return heights, np.bincount(rows, minlength=count)
+
+    def getPointHeightsByDistance(self, points: np.ndarray, stats: RenderStats = NO_STATS) -> np.ndarray:
+        """Schnelle Näherung von getPointHeights ohne Strahlen: für jeden Punkt wird nur die nächste Kante seiner Platte
+        gesucht und die Relieffunktion dieser Grenze mit dem (exakten) Abstand zu ihr ausgewertet. Der Aufwand ist linear in
+        der Anzahl Punkte und hängt nicht von der Anzahl Strahlen ab.
+
+        Genauigkeit: getPointHeight bildet einen gewichteten Mittelwert über die Kanten, die seine Strahlen treffen, hier
+        wird nur der Wert der nächsten Kante genommen. Eine Fehlerschranke gibt es dafür nicht, besonders nicht für Strahlen,
+        die über den Rand der Welt laufen und dort eine andere Kante treffen. Gut stimmen die Resultate überein, wenn alle
+        Strahlen dieselbe Kante treffen (z.B. nahe an einer langen Grenze), am schlechtesten bei Punkten, die von mehreren
+        Grenzen mit unterschiedlichen Interaktionen etwa gleich weit entfernt sind. Gemessen auf zufälligen Welten
+        (256x256, 50 Teilungen) war die mittlere Abweichung zu getPointHeights mit res=12 etwa 0.3 und die grösste etwa 0.8,
+        bei Höhen zwischen 0.1 und 1.1.
+        Grenzen über den Rand der Welt zur eigenen Platte zählen nicht; dafür werden auch die Kanten der Geisterkopien der
+        Platte (siehe ghosts.GhostLayer) berücksichtigt.
+        :param points: die Punkte, Form (n, 2)
+        :param stats: siehe getPointHeight"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        heights = np.empty(len(points))
+        threshold = 0.001
+        stats.count("points", len(points))
+
+        with stats.stage("plate_lookup"):
+            homes = self.getPlates(points)
+            plate_ids = self._plate_ids()
+        for home_index in np.unique(homes):
+            homeplate = self.plates[home_index]
+            vertices = homeplate.vertex_array
+            selection = np.flatnonzero(homes == home_index)
+            P = points[selection]
+            with stats.stage("intersection"):
+                d = np.roll(vertices, -1, axis=0) - vertices
+                lengths = np.linalg.norm(d, axis=1)
+                real = np.array([lengths[i] > 0 and not (segments and all(segment[2] is homeplate for segment in segments))
+                                 for i, segments in enumerate(self.adjacency.edges[homeplate])])
+                offsets = [(0., 0.)]
+                if not real.any():
+                    # die Platte grenzt nur an sich selbst (z.B. eine Welt mit nur einer Platte)
+                    real = lengths > 0
+                elif not real[lengths > 0].all():
+                    # die nächste echte Grenze kann über den Rand der Welt hinweg liegen
+                    offsets += self.index.ghosts.ghost_offsets(homeplate)
+                # die Kanten der Platte selbst (Verschiebung (0, 0)) und die ihrer Geisterkopien, Form (Kopie, Kante, 2)
+                offsets = np.array(offsets)
+                starts = vertices[None, :, :] + offsets[:, None, :]
+                # kleinster Abstand zu den Kanten (als Strecken, da die Platte mit ihren Geistern nicht mehr konvex ist).
+                # Innerhalb der Platte ist das derselbe Abstand wie zur nächsten Geraden einer Kante.
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    t = np.clip(np.einsum("noek,ek->noe", P[:, None, None, :] - starts, d) / lengths**2, 0, 1)
+                feet = starts + t[..., None] * d
+                edge_distance = np.linalg.norm(P[:, None, None, :] - feet, axis=-1)
+                edge_distance[:, :, ~real] = np.inf
+                nearest = np.argmin(edge_distance.reshape(len(P), -1), axis=1)
+                copies, edges = np.divmod(nearest, len(vertices))
+                distance = edge_distance[np.arange(len(P)), copies, edges]
+                # Fusspunkt auf der nächsten Kante, in der Platte selbst
+                F = feet[np.arange(len(P)), copies, edges] - offsets[copies]
+
+            with stats.stage("neighbour_lookup"):
+                neighbours = self.adjacency.neighbour_array(homeplate, edges, F, plate_ids)
+                unknown = neighbours == -1
+                if unknown.any():
+                    stats.count("neighbour_fallbacks", unknown.sum())
+                    direction = F[unknown] + offsets[copies[unknown]] - P[unknown]
+                    Q = F[unknown] + direction / np.linalg.norm(direction, axis=1)[:, None] * threshold
+                    neighbours[unknown] = self.getPlates(Q)
+
+            with stats.stage("height_function"):
+                heights[selection] = self._edge_heights(homeplate, vertices, neighbours, edges, distance*.1)
+
+        return heights
+
+    def _heights(self, points: np.ndarray, res: int, engine: str, stats: RenderStats = NO_STATS) -> np.ndarray:
+        # berechnet die Höhen der Punkte mit der gewählten Engine (siehe render_world)
+        if engine == "vector":
+            return self.getPointHeights(points, res, stats=stats)
+        elif engine == "distance":
+            return self.getPointHeightsByDistance(points, stats)
+        elif engine == "adaptive":
+            return self.getPointHeightsAdaptive(points, ADAPTIVE_REFINEMENT*res, res, stats=stats)[0]
+        elif engine == "scalar":
+            return np.array([self.getPointHeight(point, res, stats) for point in points], dtype=float)
+        raise ValueError(f"Unknown engine {engine!r}")
+
+    def render_tile(self, tile: tuple[int, int, int, int], res: int = 6, engine: Engine = "scalar",
+                    stats: RenderStats = NO_STATS) -> np.ndarray:
+        """Calculates the height of all points in a rectangular part of the world.
+        :param tile: the part of the world as (x0, y0, x1, y1), x1 and y1 excluded
+        :param res: Accuracy of the height value for each point
+        :param engine: see render_world
+        :param stats: see render_world
+        :returns: a 2D-Array of shape (y1-y0, x1-x0)"""
+        x0, y0, x1, y1 = tile
+        ys, xs = np.mgrid[y0:y1, x0:x1]
+        return self._heights(np.stack([xs.ravel(), ys.ravel()], axis=1), res, engine, stats).reshape(xs.shape)
+
+    def render_world(self, res: int = 6, engine: Engine = "scalar",
+                     workers: int | None = None, tile_size: int = 64,
+                     progress: Callable[[int, int], None] | None = None, stats: RenderStats | None = None) -> np.ndarray:
         """Calculates the height of all points and returns them in a 2D-Array.
-        :param res: Accuracy of the height value for each point"""
-        A = np.zeros(self.size)
-        for y in range(self.size[1]):
-            for x in range(self.size[0]):
-                h = self.getPointHeight(np.array([x, y]), res)
-                A[y, x] = h
-                sys.stdout.write("\r" + f"{x}, {y}")
+        The world is rendered in tiles, the result doesn't depend on the tile size.
+        :param res: Accuracy of the height value for each point
+        :param engine: "scalar" calls getPointHeight for every point, "vector" calculates all points at once with getPointHeights,
+                       "distance" uses getPointHeightsByDistance, which doesn't cast rays (fast, but only an approximation,
+                       res is ignored), "adaptive" uses getPointHeightsAdaptive, which starts with res rays per point and
+                       adds up to ADAPTIVE_REFINEMENT times as many where they are needed (see render_ray_counts).
+        :param workers: if given, the tiles are rendered on this many processes (see render.render_parallel).
+                        The result is identical to the serial one.
+        :param tile_size: side length of the tiles
+        :param progress: called with (finished points, total points) after finished tiles, at most every 0.5 seconds
+                         (e.g. instrumentation.print_progress)
+        :param stats: if given, the time spent in every stage of the calculation and some counters are added to it"""
+        self.dirty_plates.clear()
+        stats = stats if stats is not None else NO_STATS
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}")
+        if workers is not None:
+            return render.render_parallel(self, res, engine, workers, tile_size, progress, stats)
+
+        A = np.zeros((self.size[1], self.size[0]))
+        reporter = Progress(progress, self.size[0] * self.size[1])
+        for x0, y0, x1, y1 in render.iter_tiles(self.size, tile_size):
+            A[y0:y1, x0:x1] = self.render_tile((x0, y0, x1, y1), res, engine, stats)
+            reporter.update((x1-x0) * (y1-y0))
+        return A
+
+    def render_adaptive(self, res: int = 6, tolerance: float = 0.01, base_step: int = 8,
+                        engine: Engine = "vector", stats: RenderStats | None = None) -> np.ndarray:
+        """Renders the world on a coarse grid first and only refines cells near plate boundaries or where the height changes by
+        more than :param tolerance, the rest is interpolated. See render.render_adaptive.
+        :param res: Accuracy of the height value for each point
+        :param tolerance: maximal height difference of the corners of a cell that is interpolated
+        :param base_step: spacing of the coarse grid in pixels
+        :param engine: see render_world
+        :param stats: see render_world. The counters "samples" and "interpolated" tell how many points were calculated and interpolated."""
+        self.dirty_plates.clear()
+        return render.render_adaptive(self, res, tolerance, base_step, engine, stats if stats is not None else NO_STATS)
+
+    def render_ray_counts(self, res: int = 12, tolerance: float = 1e-3, tile_size: int = 64,
+                          stats: RenderStats | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Renders the world like render_world with engine="adaptive" and also returns how many rays were used for every point.
+        :param res: number of rays every point starts with
+        :param tolerance: see getPointHeightsAdaptive
+        :param tile_size: side length of the tiles
+        :param stats: see render_world
+        :returns: the heights and the ray counts, both of shape (height, width)"""
+        self.dirty_plates.clear()
+        stats = stats if stats is not None else NO_STATS
+        A = np.zeros((self.size[1], self.size[0]))
+        counts = np.zeros((self.size[1], self.size[0]), dtype=np.intp)
+        for x0, y0, x1, y1 in render.iter_tiles(self.size, tile_size):
+            ys, xs = np.mgrid[y0:y1, x0:x1]
+            heights, rays = self.getPointHeightsAdaptive(np.stack([xs.ravel(), ys.ravel()], axis=1), ADAPTIVE_REFINEMENT*res,
+                                                         res, tolerance, stats=stats)
+            A[y0:y1, x0:x1] = heights.reshape(xs.shape)
+            counts[y0:y1, x0:x1] = rays.reshape(xs.shape)
+        return A, counts
+
+    def render_to_file(self, path: str, res: int = 6, engine: Engine = "scalar", tile_size: int = 64,
+                       progress: Callable[[int, int], None] | None = None, stats: RenderStats | None = None) -> np.ndarray:
+        """Renders the world tile by tile into a memory-mapped .npy file and returns it (opened read-only).
+        An interrupted render is continued from the last finished tile, see render.stream_to_file.
+        :param path: the .npy file
+        :param res: Accuracy of the height value for each point
+        :param engine: see render_world
+        :param tile_size: side length of the tiles
+        :param progress: see render_world. Tiles finished in an earlier run are not counted.
+        :param stats: see render_world"""
+        self.dirty_plates.clear()
+        reporter = Progress(progress, self.size[0] * self.size[1])
+        for _, heights in render.stream_to_file(self, path, res, engine, tile_size, stats if stats is not None else NO_STATS):
+            reporter.update(heights.size)
+        return np.load(path, mmap_mode="r")
+
+    def dirty_mask(self) -> np.ndarray:
+        """Gibt ein Array der Form (Höhe, Breite) zurück, das für jeden Pixel angibt, ob sich seine Höhe seit dem letzten
+        Rendern verändert haben könnte."""
+        dirty = [self.plates.index(plate) for plate in self.dirty_plates]
+        if not dirty:
+            return np.zeros((self.size[1], self.size[0]), dtype=bool)
+        ys, xs = np.mgrid[0:self.size[1], 0:self.size[0]]
+        homes = self.getPlates(np.stack([xs.ravel(), ys.ravel()], axis=1)).reshape(xs.shape)
+        return np.isin(homes, dirty)
+
+    def update_render(self, previous_heightmap: np.ndarray, res: int = 6,
+                      engine: Engine = "scalar") -> np.ndarray:
+        """Brings a heightmap up to date after one or more splits by recalculating only the points whose height could have
+        changed (see dirty_mask). The result is the same as calling render_world again.
+        :param previous_heightmap: the result of the last render_world (or update_render) call. It is not modified.
+        :param res: Accuracy of the height value for each point, must be the same as for previous_heightmap
+        :param engine: see render_world"""
+        A = np.array(previous_heightmap, dtype=float)
+        ys, xs = np.nonzero(self.dirty_mask())
+        A[ys, xs] = self._heights(np.stack([xs, ys], axis=1), res, engine)
+
+        self.dirty_plates.clear()
         return A
+
+    def save(self, path: str, heightmaps: dict[str, np.ndarray] | None = None) -> None:
+        """Speichert die Welt (und optional gerenderte Höhenkarten) als Snapshot im Ordner :param path, siehe snapshot.py."""
+        snapshot.save_world(self, path, heightmaps)
+
+    @staticmethod
+    def load(path: str) -> World:
+        """Lädt eine mit save gespeicherte Welt. Die Höhenkarten lädt man mit snapshot.load_heightmap."""
+        return snapshot.load_world(path)